@@ -17,13 +17,14 @@ from apscheduler.triggers.cron import CronTrigger
 import subprocess
 import hashlib
 import logging
+import asyncio
 import json
 import sys
 import os
 
 parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.insert(0, parent_dir)
-from quark_auto_save import Quark
+from quark_auto_save import Quark, create_session
 
 
 def get_app_ver():
@@ -207,11 +208,15 @@ def get_share_files():
     shareurl = request.args.get("shareurl", "")
     account = Quark("", 0)
     pwd_id, pdir_fid = account.get_id_from_url(shareurl)
-    is_sharing, stoken = account.get_stoken(pwd_id)
-    if not is_sharing:
-        return jsonify({"error": stoken})
-    share_file_list = account.get_detail(pwd_id, stoken, pdir_fid)
-    return jsonify(share_file_list)
+
+    async def get_share_file_list():
+        async with create_session() as session:
+            is_sharing, stoken = await account.get_stoken(session, pwd_id)
+            if not is_sharing:
+                return {"error": stoken}
+            return await account.get_detail(session, pwd_id, stoken, pdir_fid)
+
+    return jsonify(asyncio.run(get_share_file_list()))
 
 
 @app.route("/get_savepath")
@@ -220,17 +225,22 @@ def get_savepath():
         return jsonify({"error": "未登录"})
     data = read_json()
     account = Quark(data["cookie"][0], 0)
-    if path := request.args.get("path"):
-        if path == "/":
-            fid = 0
-        elif get_fids := account.get_fids([path]):
-            fid = get_fids[0]["fid"]
-        else:
-            return jsonify([])
-    else:
-        fid = request.args.get("fid", 0)
-    file_list = account.ls_dir(fid)
-    return jsonify(file_list)
+    path = request.args.get("path")
+    fid = request.args.get("fid", 0)
+
+    async def get_file_list():
+        async with create_session() as session:
+            pdir_fid = fid
+            if path:
+                if path == "/":
+                    pdir_fid = 0
+                elif get_fids := await account.get_fids(session, (path,)):
+                    pdir_fid = get_fids[0]["fid"]
+                else:
+                    return []
+            return await account.ls_dir(session, pdir_fid)
+
+    return jsonify(asyncio.run(get_file_list()))
 
 
 # 定时任务执行的函数
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+转存引擎热点微基准
+
+不发起网络请求，只对引擎内部的 CPU 热点做计时，便于比较不同实现或依赖。
+
+用法:
+    python3 benchmark_micro.py json --entries 50,1000,5000
+    python3 benchmark_micro.py exists --entries 1000,5000   # 分享 N 条 × 目标目录 N 条
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+from typing import Any, Callable, Dict, List
+
+from fake_quark_server import FakeShare
+
+# 导入引擎会在当前目录创建日志文件，切到临时目录避免污染工作区
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp(prefix="quark_micro_"))
+import quark_auto_save  # noqa: E402
+
+
+def timeit(func: Callable[[], Any], min_time: float) -> Dict[str, float]:
+    """重复执行直到累计耗时超过 min_time，返回单次平均耗时"""
+    loops, elapsed = 0, 0.0
+    start = time.perf_counter()
+    while elapsed < min_time:
+        func()
+        loops += 1
+        elapsed = time.perf_counter() - start
+    return {"loops": loops, "per_call_ms": elapsed / loops * 1000}
+
+
+def detail_page(entries: int) -> bytes:
+    """构造一页 sharepage/detail 响应体，结构与模拟服务一致"""
+    share = FakeShare("micro", entries, 0, 0, False)
+    items = share.listing("0")
+    body = {
+        "status": 200, "code": 0, "message": "ok",
+        "data": {"list": items},
+        "metadata": {"_total": len(items), "_page": 1, "_size": len(items), "_count": len(items)},
+    }
+    return json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+
+def bench_json(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    backends: Dict[str, Callable[[bytes], Any]] = {
+        # 旧路径：aiohttp response.json() 先解码成 str 再交给标准库
+        "aiohttp.json()": lambda body: json.loads(body.decode("utf-8")),
+    }
+    for name, loads in quark_auto_save.JSON_BACKENDS.items():
+        backends[f"decode_body[{name}]"] = lambda body, loads=loads: loads(body)
+    results = []
+    for entries in args.entries:
+        body = detail_page(entries)
+        print(f"detail 单页 {entries} 条，响应体 {len(body) / 1024:.1f}KB")
+        for name, loads in backends.items():
+            result = timeit(lambda: loads(body), args.min_time)
+            mb_s = len(body) / 1024 / 1024 / (result["per_call_ms"] / 1000)
+            print(f"    {name:<22}{result['per_call_ms']:>10.3f} ms/页{mb_s:>10.1f} MB/s")
+            results.append({"case": "json", "entries": entries, "bytes": len(body), "backend": name, **result})
+    return results
+
+
+def linear_exists(dir_file_list: List[Dict[str, Any]], file_name: str, save_name: str, ignore_extension: bool) -> bool:
+    """旧实现：每个分享文件都与目标目录逐条比较，忽略后缀时在内层循环里反复 splitext"""
+    if ignore_extension:
+        def compare_func(a: str, b1: str, b2: str) -> bool:
+            return (os.path.splitext(a)[0] == os.path.splitext(b1)[0]
+                    or os.path.splitext(a)[0] == os.path.splitext(b2)[0])
+    else:
+        def compare_func(a: str, b1: str, b2: str) -> bool:
+            return a == b1 or a == b2
+    return any(compare_func(dir_file["file_name"], file_name, save_name) for dir_file in dir_file_list)
+
+
+def bench_exists(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    pattern, replace = quark_auto_save.MAGIC_REGEX["$TV"]["pattern"], quark_auto_save.MAGIC_REGEX["$TV"]["replace"]
+    results = []
+    for entries in args.entries:
+        share_list = FakeShare("micro", entries, 0, 0, False).listing("0")
+        pairs = [(item["file_name"], re.sub(pattern, replace, item["file_name"])) for item in share_list]
+        # 目标目录里已有一半文件（转存后已重命名），另一半是无关文件，查找命中和未命中各占一半
+        dir_file_list = [{"file_name": save_name, "dir": False, "fid": f"d{i}"} for i, (_, save_name) in enumerate(pairs[: entries // 2])]
+        dir_file_list += [{"file_name": f"Other.{i:05d}.mkv", "dir": False, "fid": f"o{i}"} for i in range(entries - len(dir_file_list))]
+        print(f"分享 {entries} 条 × 目标目录 {len(dir_file_list)} 条")
+        for ignore_extension in (False, True):
+            def linear():
+                return sum(linear_exists(dir_file_list, name, save_name, ignore_extension) for name, save_name in pairs)
+
+            def indexed():
+                # 索引每次运行按目标目录列表建一次，计入耗时
+                existing = quark_auto_save.NameIndex(dir_file_list)
+                return sum(existing.exists(name, save_name, ignore_extension) for name, save_name in pairs)
+
+            # 两种实现的判断结果必须一致
+            assert linear() == indexed()
+            for name, func in (("逐条比较", linear), ("NameIndex", indexed)):
+                result = timeit(func, args.min_time)
+                print(f"    {name:<12}忽略后缀={'是' if ignore_extension else '否'}{result['per_call_ms']:>12.3f} ms")
+                results.append({"case": "exists", "entries": entries, "ignore_extension": ignore_extension, "impl": name, **result})
+    return results
+
+
+CASES = {
+    "json": bench_json,
+    "exists": bench_exists,
+}
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="转存引擎热点微基准")
+    parser.add_argument("case", choices=sorted(CASES), help="基准项")
+    parser.add_argument("--entries", type=int_list, default=[50, 1000, 5000], help="单页条目数，可用逗号分隔多个值")
+    parser.add_argument("--min-time", type=float, default=0.5, help="每项最少计时秒数")
+    parser.add_argument("--output", help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    results = CASES[args.case](args)
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {output}")
+
+
+if __name__ == "__main__":
+    main()
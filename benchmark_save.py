@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+转存引擎端到端压测
+
+在本地启动 fake_quark_server 模拟服务，生成 N 个账号 × M 个任务 × K 个文件的配置，
+以子进程方式运行 quark_auto_save.py，并统计耗时、各接口请求数以及子进程峰值内存。
+
+用法:
+    python3 benchmark_save.py --accounts 1,3 --tasks 10,50 --files 50,500 --latency-ms 30
+    python3 benchmark_save.py --runs 2 --output bench.json   # 第二轮为无新增文件的增量运行
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import itertools
+import threading
+import subprocess
+from typing import Dict, List, Any
+
+from fake_quark_server import FakeQuarkServer, add_server_arguments, server_from_args
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "quark_auto_save.py")
+
+
+class ServerThread:
+    """在后台线程的事件循环中运行模拟服务，主线程负责拉起被测子进程"""
+
+    def __init__(self, server: FakeQuarkServer):
+        self.server = server
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def __enter__(self) -> str:
+        self.thread.start()
+        return self.call(self.server.start())
+
+    def __exit__(self, *exc) -> None:
+        self.call(self.server.stop())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def snapshot(self) -> Dict[str, Any]:
+        async def _snapshot():
+            return self.server.snapshot(reset=True)
+        return self.call(_snapshot())
+
+
+def build_config(accounts: int, tasks: int) -> Dict[str, Any]:
+    cookies = []
+    for a in range(accounts):
+        tasklist = [
+            {
+                "taskname": f"bench-{a}-{t}",
+                "shareurl": f"https://pan.quark.cn/s/bench{a}x{t}",
+                "savepath": f"/bench/acc{a}/task{t:04d}",
+                "pattern": "$TV",
+                "replace": "",
+                "enddate": "",
+                "emby_id": "",
+                "ignore_extension": False,
+                "runweek": [1, 2, 3, 4, 5, 6, 7],
+            }
+            for t in range(tasks)
+        ]
+        cookies.append({
+            "name": f"bench{a}",
+            "cookie": f"__uid=bench{a}; kps=k{a}; sign=s{a}; vcode=v{a}",
+            "tasklist": tasklist,
+        })
+    return {"cookies": cookies, "emby": {"url": "", "apikey": ""}}
+
+
+def run_engine(base_url: str, config_path: str, workdir: str) -> Dict[str, Any]:
+    """运行一次 quark_auto_save.py，返回耗时、退出码和峰值内存"""
+    env = dict(os.environ, QUARK_API_BASE=base_url, QUARK_PAN_BASE=base_url)
+    with open(os.path.join(workdir, "engine_stdout.log"), "ab") as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, SCRIPT_PATH, config_path], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 能拿到单个子进程的 rusage，RUSAGE_CHILDREN 只给出所有子进程的累计最大值
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # 引擎自身记录的各接口耗时分位数（见 RequestMetrics）
+    metrics_path = os.path.join(workdir, "quark_metrics.json")
+    engine_metrics = {}
+    if os.path.exists(metrics_path):
+        with open(metrics_path, "r", encoding="utf-8") as f:
+            engine_metrics = json.load(f)
+    return {
+        "wall_s": round(wall, 3),
+        "returncode": proc.returncode,
+        # Linux 下 ru_maxrss 单位为 KB
+        "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1),
+        "engine_metrics": engine_metrics,
+    }
+
+
+def run_scenario(args: argparse.Namespace, accounts: int, tasks: int, files: int) -> List[Dict[str, Any]]:
+    results = []
+    server_thread = ServerThread(server_from_args(args, files))
+    with server_thread as base_url, tempfile.TemporaryDirectory(prefix="quark_bench_") as workdir:
+        config_path = os.path.join(workdir, "quark_config.json")
+        with open(config_path, "w", encoding="utf-8") as f:
+            json.dump(build_config(accounts, tasks), f, ensure_ascii=False, indent=2)
+        for run in range(1, args.runs + 1):
+            result = run_engine(base_url, config_path, workdir)
+            stats = server_thread.snapshot()
+            result.update({
+                "accounts": accounts,
+                "tasks": tasks,
+                "files": files,
+                "run": run,
+                "requests_total": stats["total"],
+                "requests": stats["requests"],
+                "errors": stats["errors"],
+            })
+            results.append(result)
+            print_result(result)
+    return results
+
+
+def print_result(result: Dict[str, Any]) -> None:
+    print(
+        f"N={result['accounts']} M={result['tasks']} K={result['files']} 第{result['run']}轮: "
+        f"耗时 {result['wall_s']}s，请求 {result['requests_total']} 次，"
+        f"峰值内存 {result['peak_rss_mb']}MB，退出码 {result['returncode']}"
+    )
+    for endpoint, count in sorted(result["requests"].items(), key=lambda x: -x[1]):
+        errors = result["errors"].get(endpoint, 0)
+        line = f"    {endpoint:<16}{count:>8}"
+        stats = result["engine_metrics"].get(endpoint)
+        if stats:
+            line += f"  p50 {stats['p50_ms']:>7}ms  p95 {stats['p95_ms']:>7}ms"
+        print(line + (f"  (错误 {errors})" if errors else ""))
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="转存引擎端到端压测")
+    parser.add_argument("--accounts", type=int_list, default=[1], help="账号数 N，可用逗号分隔多个值")
+    parser.add_argument("--tasks", type=int_list, default=[10], help="每个账号的任务数 M")
+    parser.add_argument("--files", type=int_list, default=[50], help="每个分享的文件数 K")
+    parser.add_argument("--runs", type=int, default=1, help="每个场景连续运行的轮数")
+    parser.add_argument("--output", help="将结果写入 JSON 文件")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    results = []
+    for accounts, tasks, files in itertools.product(args.accounts, args.tasks, args.files):
+        results.extend(run_scenario(args, accounts, tasks, files))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
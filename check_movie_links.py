@@ -9,10 +9,9 @@ import hashlib
 import base64
 import urllib.parse
 import asyncio
-import aiohttp
 import re
 import os
-from quark_auto_save import Quark
+from quark_auto_save import Quark, create_session
 from check_quark_links import print_bordered_table
 
 # 钉钉通知配置
@@ -102,7 +101,7 @@ async def check_movie_links(config_file):
             print("错误: 配置文件中没有找到 cookie。", file=sys.stderr)
             return 1
 
-        async with aiohttp.ClientSession() as session:
+        async with create_session() as session:
             # 创建Quark对象
             quark = Quark(cookie, 0)
             
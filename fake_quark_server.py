@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+夸克网盘接口本地模拟服务
+
+实现 quark_auto_save.Quark 用到的全部接口（分享 token/详情、目录列表、path_list、
+转存、任务查询、新建/重命名/删除、回收站、账号信息、签到），用于在不访问真实服务的
+情况下测量转存引擎的性能。延迟、分页上限、错误率以及分享数据的规模均可配置。
+
+用法:
+    python3 fake_quark_server.py --port 8848 --latency-ms 30 --files 200
+    QUARK_API_BASE=http://127.0.0.1:8848 python3 quark_auto_save.py quark_config.json
+"""
+
+import re
+import time
+import random
+import asyncio
+import argparse
+import itertools
+from collections import Counter
+from typing import Dict, List, Any, Optional
+
+from aiohttp import web
+
+# 路径 -> 统计用的接口名
+ENDPOINT_NAMES: Dict[str, str] = {
+    "/account/info": "account_info",
+    "/1/clouddrive/capacity/growth/info": "growth_info",
+    "/1/clouddrive/capacity/growth/sign": "growth_sign",
+    "/1/clouddrive/share/sharepage/token": "token",
+    "/1/clouddrive/share/sharepage/detail": "detail",
+    "/1/clouddrive/share/sharepage/save": "save",
+    "/1/clouddrive/file/info/path_list": "path_list",
+    "/1/clouddrive/file/sort": "sort",
+    "/1/clouddrive/file": "mkdir",
+    "/1/clouddrive/file/rename": "rename",
+    "/1/clouddrive/file/delete": "delete",
+    "/1/clouddrive/file/recycle/list": "recycle_list",
+    "/1/clouddrive/file/recycle/remove": "recycle_remove",
+    "/1/clouddrive/task": "task",
+}
+
+
+def _ok(data: Any, **extra: Any) -> web.Response:
+    body = {"status": 200, "code": 0, "message": "ok", "data": data}
+    body.update(extra)
+    return web.json_response(body)
+
+
+def _err(code: int, message: str, status: int = 200) -> web.Response:
+    return web.json_response({"status": status, "code": code, "message": message}, status=status)
+
+
+def _node(fid: str, name: str, is_dir: bool, pdir_fid: str, ts_ms: int, size: int = 0) -> Dict[str, Any]:
+    return {
+        "fid": fid,
+        "file_name": name,
+        "pdir_fid": pdir_fid,
+        "dir": is_dir,
+        "file": not is_dir,
+        "file_type": 0 if is_dir else 1,
+        "category": 0 if is_dir else 1,
+        "obj_category": "" if is_dir else "video",
+        "size": 0 if is_dir else size,
+        "created_at": ts_ms,
+        "updated_at": ts_ms,
+    }
+
+
+def _sort_listing(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # 与客户端请求的 _sort=file_type:asc,updated_at:desc 保持一致
+    return sorted(items, key=lambda x: (x["file_type"], -x["updated_at"]))
+
+
+def _page(items: List[Dict[str, Any]], page: int, size: int) -> List[Dict[str, Any]]:
+    start = (page - 1) * size
+    return items[start:start + size]
+
+
+class FakeShare:
+    """按 pwd_id 确定性生成的分享内容"""
+
+    def __init__(self, pwd_id: str, files: int, dirs: int, files_per_dir: int, root_folder: bool):
+        self.pwd_id = pwd_id
+        self.nodes: Dict[str, Dict[str, Any]] = {}
+        self.children: Dict[str, List[str]] = {}
+        base_ts = int(time.time() * 1000) - 86400 * 1000
+        top = "0"
+        if root_folder:
+            top = self._add(f"{pwd_id}_root", pwd_id, True, "0", base_ts)
+        for d in range(dirs):
+            dir_fid = self._add(f"{pwd_id}_d{d}", f"Season {d + 1:02d}", True, top, base_ts + d)
+            for n in range(files_per_dir):
+                self._add(f"{pwd_id}_d{d}_{n}", f"S{d + 1:02d}E{n + 1:03d}.mp4", False, dir_fid, base_ts + n * 1000)
+        for n in range(files):
+            self._add(f"{pwd_id}_{n}", f"Show.E{n + 1:03d}.1080p.mp4", False, top, base_ts + n * 1000)
+
+    def _add(self, fid: str, name: str, is_dir: bool, pdir_fid: str, ts_ms: int) -> str:
+        node = _node(fid, name, is_dir, pdir_fid, ts_ms, size=1024 * 1024 * 700)
+        node["share_fid_token"] = f"tk_{fid}"
+        self.nodes[fid] = node
+        self.children.setdefault(pdir_fid, []).append(fid)
+        return fid
+
+    def listing(self, pdir_fid: str) -> List[Dict[str, Any]]:
+        return _sort_listing([self.nodes[fid] for fid in self.children.get(pdir_fid, [])])
+
+
+class FakeDrive:
+    """单个账号的网盘目录树"""
+
+    def __init__(self, uid: str, fid_counter: "itertools.count[int]"):
+        self.uid = uid
+        self.nodes: Dict[str, Dict[str, Any]] = {}
+        self.children: Dict[str, List[str]] = {"0": []}
+        self.names: Dict[tuple, str] = {}
+        self.recycle: Dict[str, Dict[str, Any]] = {}
+        self.signed = False
+        self._fid_counter = fid_counter
+
+    def new_fid(self) -> str:
+        return f"{next(self._fid_counter):032x}"
+
+    def child_by_name(self, pdir_fid: str, name: str) -> Optional[str]:
+        return self.names.get((pdir_fid, name))
+
+    def resolve(self, path: str) -> Optional[str]:
+        fid = "0"
+        for part in [p for p in path.split("/") if p]:
+            fid = self.child_by_name(fid, part)
+            if fid is None or not self.nodes[fid]["dir"]:
+                return None
+        return fid
+
+    def add(self, pdir_fid: str, name: str, is_dir: bool, size: int = 0) -> str:
+        fid = self.new_fid()
+        self.nodes[fid] = _node(fid, name, is_dir, pdir_fid, int(time.time() * 1000), size)
+        self.children.setdefault(pdir_fid, []).append(fid)
+        self.names[(pdir_fid, name)] = fid
+        if is_dir:
+            self.children.setdefault(fid, [])
+        return fid
+
+    def mkdirs(self, path: str) -> str:
+        fid = "0"
+        for part in [p for p in path.split("/") if p]:
+            fid = self.child_by_name(fid, part) or self.add(fid, part, True)
+        return fid
+
+    def remove(self, fid: str) -> None:
+        for child in list(self.children.get(fid, [])):
+            self.remove(child)
+        self.children.pop(fid, None)
+        node = self.nodes.pop(fid, None)
+        if node:
+            self.names.pop((node["pdir_fid"], node["file_name"]), None)
+            siblings = self.children.get(node["pdir_fid"], [])
+            if fid in siblings:
+                siblings.remove(fid)
+
+    def listing(self, pdir_fid: str) -> List[Dict[str, Any]]:
+        return _sort_listing([self.nodes[fid] for fid in self.children.get(pdir_fid, [])])
+
+
+class FakeQuarkServer:
+    """夸克接口模拟服务，状态全部保存在内存中"""
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        max_page_size: int = 100,
+        files: int = 50,
+        dirs: int = 0,
+        files_per_dir: int = 10,
+        root_folder: bool = False,
+        task_polls: int = 1,
+        save_limit: int = 0,
+        stoken_ttl: float = 0.0,
+        seed: int = 0,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_page_size = max_page_size
+        self.files = files
+        self.dirs = dirs
+        self.files_per_dir = files_per_dir
+        self.root_folder = root_folder
+        self.task_polls = task_polls
+        self.save_limit = save_limit
+        self.stoken_ttl = stoken_ttl
+        self.random = random.Random(seed)
+        self.shares: Dict[str, FakeShare] = {}
+        self.drives: Dict[str, FakeDrive] = {}
+        self.stokens: Dict[str, tuple] = {}
+        self.tasks: Dict[str, Dict[str, Any]] = {}
+        self.stats: Counter = Counter()
+        self.errors: Counter = Counter()
+        self._fid_counter = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+
+    # ---------- 基础设施 ----------
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get("/account/info", self.account_info)
+        app.router.add_get("/1/clouddrive/capacity/growth/info", self.growth_info)
+        app.router.add_post("/1/clouddrive/capacity/growth/sign", self.growth_sign)
+        app.router.add_post("/1/clouddrive/share/sharepage/token", self.share_token)
+        app.router.add_get("/1/clouddrive/share/sharepage/detail", self.share_detail)
+        app.router.add_post("/1/clouddrive/share/sharepage/save", self.share_save)
+        app.router.add_post("/1/clouddrive/file/info/path_list", self.path_list)
+        app.router.add_get("/1/clouddrive/file/sort", self.file_sort)
+        app.router.add_post("/1/clouddrive/file", self.mkdir)
+        app.router.add_post("/1/clouddrive/file/rename", self.rename)
+        app.router.add_post("/1/clouddrive/file/delete", self.delete)
+        app.router.add_get("/1/clouddrive/file/recycle/list", self.recycle_list)
+        app.router.add_post("/1/clouddrive/file/recycle/remove", self.recycle_remove)
+        app.router.add_get("/1/clouddrive/task", self.task)
+        app.router.add_get("/__stats", self.stats_handler)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        if request.path.startswith("/__"):
+            return await handler(request)
+        endpoint = ENDPOINT_NAMES.get(request.path, request.path)
+        self.stats[endpoint] += 1
+        if self.latency_ms or self.jitter_ms:
+            await asyncio.sleep((self.latency_ms + self.random.uniform(0, self.jitter_ms)) / 1000)
+        roll = self.random.random()
+        if roll < self.throttle_rate:
+            self.errors[endpoint] += 1
+            return _err(429, "请求过于频繁，请稍后再试", status=429)
+        if roll < self.throttle_rate + self.error_rate:
+            self.errors[endpoint] += 1
+            return _err(500, "internal server error", status=500)
+        return await handler(request)
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Any]:
+        """返回各接口请求计数，reset=True 时清零"""
+        data = {
+            "requests": dict(self.stats),
+            "errors": dict(self.errors),
+            "total": sum(self.stats.values()),
+        }
+        if reset:
+            self.stats.clear()
+            self.errors.clear()
+        return data
+
+    async def stats_handler(self, request: web.Request) -> web.Response:
+        return web.json_response(self.snapshot(reset=request.query.get("reset") == "1"))
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{bound_port}"
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def drive(self, request: web.Request) -> FakeDrive:
+        cookie = request.headers.get("cookie", "")
+        match = re.search(r"__uid=([^;\s]+)", cookie)
+        uid = match.group(1) if match else (cookie or "anonymous")
+        if uid not in self.drives:
+            self.drives[uid] = FakeDrive(uid, self._fid_counter)
+        return self.drives[uid]
+
+    def share(self, pwd_id: str) -> FakeShare:
+        if pwd_id not in self.shares:
+            self.shares[pwd_id] = FakeShare(pwd_id, self.files, self.dirs, self.files_per_dir, self.root_folder)
+        return self.shares[pwd_id]
+
+    def _page_args(self, request: web.Request):
+        page = int(request.query.get("_page", 1))
+        size = int(request.query.get("_size", 50))
+        if size > self.max_page_size:
+            return page, size, _err(400, f"_size 超出上限 {self.max_page_size}", status=400)
+        return page, size, None
+
+    # ---------- 账号 ----------
+
+    async def account_info(self, request: web.Request) -> web.Response:
+        drive = self.drive(request)
+        return web.json_response({"success": True, "code": "OK", "data": {"nickname": f"bench-{drive.uid}"}})
+
+    async def growth_info(self, request: web.Request) -> web.Response:
+        drive = self.drive(request)
+        return _ok({
+            "88VIP": False,
+            "total_capacity": 10 * 1024 ** 4,
+            "cap_composition": {"sign_reward": 200 * 1024 ** 2},
+            "cap_sign": {
+                "sign_daily": drive.signed,
+                "sign_daily_reward": 20 * 1024 ** 2,
+                "sign_progress": 1 if drive.signed else 0,
+                "sign_target": 7,
+            },
+        })
+
+    async def growth_sign(self, request: web.Request) -> web.Response:
+        self.drive(request).signed = True
+        return _ok({"sign_daily_reward": 20 * 1024 ** 2})
+
+    # ---------- 分享 ----------
+
+    async def share_token(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        pwd_id = payload.get("pwd_id", "")
+        if not pwd_id or pwd_id.startswith("dead"):
+            return _err(41006, "分享不存在")
+        stoken = f"st{self.random.getrandbits(64):016x}"
+        expires = time.time() + self.stoken_ttl if self.stoken_ttl else None
+        self.stokens[stoken] = (pwd_id, expires)
+        return _ok({"stoken": stoken, "title": pwd_id, "expired_type": 1})
+
+    def _check_stoken(self, pwd_id: str, stoken: str) -> Optional[web.Response]:
+        entry = self.stokens.get(stoken)
+        if not entry or entry[0] != pwd_id:
+            return _err(41010, "分享token校验失败")
+        if entry[1] is not None and time.time() > entry[1]:
+            return _err(41010, "分享token已过期")
+        return None
+
+    async def share_detail(self, request: web.Request) -> web.Response:
+        query = request.query
+        pwd_id = query.get("pwd_id", "")
+        error = self._check_stoken(pwd_id, query.get("stoken", ""))
+        if error:
+            return error
+        page, size, error = self._page_args(request)
+        if error:
+            return error
+        items = self.share(pwd_id).listing(query.get("pdir_fid", "0") or "0")
+        page_items = _page(items, page, size)
+        return _ok({"list": page_items}, metadata={
+            "_total": len(items), "_page": page, "_size": size, "_count": len(page_items),
+        })
+
+    async def share_save(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        drive = self.drive(request)
+        pwd_id = payload.get("pwd_id", "")
+        error = self._check_stoken(pwd_id, payload.get("stoken", ""))
+        if error:
+            return error
+        fid_list = payload.get("fid_list") or []
+        if self.save_limit and len(fid_list) > self.save_limit:
+            return _err(41028, f"单次转存文件数超过上限 {self.save_limit}")
+        to_pdir_fid = payload.get("to_pdir_fid", "0")
+        if to_pdir_fid != "0" and to_pdir_fid not in drive.nodes:
+            return _err(41013, "目标文件夹不存在")
+        share = self.share(pwd_id)
+        saved = []
+        for fid in fid_list:
+            if fid in share.nodes:
+                saved.append(self._copy_share_node(share, drive, fid, to_pdir_fid))
+        task_id = f"task{self.random.getrandbits(48):012x}"
+        self.tasks[task_id] = {"polls_left": self.task_polls, "saved": saved}
+        return _ok({"task_id": task_id})
+
+    def _copy_share_node(self, share: FakeShare, drive: FakeDrive, fid: str, to_pdir_fid: str) -> str:
+        src = share.nodes[fid]
+        name = src["file_name"]
+        suffix = 1
+        while drive.child_by_name(to_pdir_fid, name):
+            stem, dot, ext = src["file_name"].rpartition(".")
+            name = f"{stem}({suffix}).{ext}" if dot and not src["dir"] else f"{src['file_name']}({suffix})"
+            suffix += 1
+        new_fid = drive.add(to_pdir_fid, name, src["dir"], src["size"])
+        if src["dir"]:
+            for child in share.children.get(fid, []):
+                self._copy_share_node(share, drive, child, new_fid)
+        return new_fid
+
+    async def task(self, request: web.Request) -> web.Response:
+        task = self.tasks.get(request.query.get("task_id", ""))
+        if task is None:
+            return _err(32003, "任务不存在")
+        if task["polls_left"] > 0:
+            task["polls_left"] -= 1
+            return _ok({"status": 0, "task_title": "分享-转存"})
+        return _ok({"status": 2, "task_title": "分享-转存", "save_as": {"save_as_top_fids": task["saved"]}})
+
+    # ---------- 文件 ----------
+
+    async def path_list(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        drive = self.drive(request)
+        data = []
+        for path in payload.get("file_path") or []:
+            fid = drive.resolve(path)
+            if fid is not None and fid != "0":
+                data.append({"file_path": path, "fid": fid})
+        return _ok(data)
+
+    async def file_sort(self, request: web.Request) -> web.Response:
+        drive = self.drive(request)
+        page, size, error = self._page_args(request)
+        if error:
+            return error
+        pdir_fid = request.query.get("pdir_fid", "0") or "0"
+        if pdir_fid != "0" and pdir_fid not in drive.nodes:
+            return _err(41013, "文件夹不存在")
+        items = drive.listing(pdir_fid)
+        page_items = _page(items, page, size)
+        return _ok({"list": page_items}, metadata={
+            "_total": len(items), "_page": page, "_size": size, "_count": len(page_items),
+        })
+
+    async def mkdir(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        drive = self.drive(request)
+        dir_path = payload.get("dir_path") or ""
+        if dir_path:
+            if drive.resolve(dir_path) is not None:
+                return _err(23008, "文件夹同名冲突")
+            return _ok({"fid": drive.mkdirs(dir_path), "finish": True})
+        pdir_fid = payload.get("pdir_fid", "0") or "0"
+        name = payload.get("file_name", "")
+        if not name or (pdir_fid != "0" and pdir_fid not in drive.nodes):
+            return _err(41013, "父文件夹不存在")
+        if drive.child_by_name(pdir_fid, name):
+            return _err(23008, "文件夹同名冲突")
+        return _ok({"fid": drive.add(pdir_fid, name, True), "finish": True})
+
+    async def rename(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        drive = self.drive(request)
+        node = drive.nodes.get(payload.get("fid", ""))
+        if node is None:
+            return _err(41013, "文件不存在")
+        if drive.child_by_name(node["pdir_fid"], payload.get("file_name", "")):
+            return _err(23008, "文件名冲突")
+        drive.names.pop((node["pdir_fid"], node["file_name"]), None)
+        drive.names[(node["pdir_fid"], payload["file_name"])] = node["fid"]
+        node["file_name"] = payload["file_name"]
+        node["updated_at"] = int(time.time() * 1000)
+        return _ok({})
+
+    async def delete(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        drive = self.drive(request)
+        for fid in payload.get("filelist") or []:
+            node = drive.nodes.get(fid)
+            if node:
+                drive.recycle[f"r{fid}"] = {"record_id": f"r{fid}", "fid": fid, "file_name": node["file_name"]}
+                drive.remove(fid)
+        task_id = f"task{self.random.getrandbits(48):012x}"
+        self.tasks[task_id] = {"polls_left": 0, "saved": []}
+        return _ok({"task_id": task_id, "finish": True})
+
+    async def recycle_list(self, request: web.Request) -> web.Response:
+        drive = self.drive(request)
+        page = int(request.query.get("_page", 1))
+        size = int(request.query.get("_size", 30))
+        items = list(drive.recycle.values())
+        return _ok({"list": _page(items, page, size)}, metadata={"_total": len(items)})
+
+    async def recycle_remove(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        drive = self.drive(request)
+        for record_id in payload.get("record_list") or []:
+            drive.recycle.pop(record_id, None)
+        return _ok({})
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    """模拟服务的命令行参数，压测脚本复用"""
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每个请求的基础延迟(毫秒)")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="额外随机延迟上限(毫秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 HTTP 500 的概率")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="返回 HTTP 429 的概率")
+    parser.add_argument("--max-page-size", type=int, default=100, help="分页接口允许的最大 _size")
+    parser.add_argument("--dirs", type=int, default=0, help="每个分享根目录下的子文件夹数")
+    parser.add_argument("--files-per-dir", type=int, default=10, help="每个子文件夹内的文件数")
+    parser.add_argument("--root-folder", action="store_true", help="分享内容包在一个顶层文件夹中")
+    parser.add_argument("--task-polls", type=int, default=1, help="转存任务完成前返回进行中的次数")
+    parser.add_argument("--save-limit", type=int, default=0, help="单次转存的文件数上限，0 为不限")
+    parser.add_argument("--stoken-ttl", type=float, default=0.0, help="stoken 有效期(秒)，0 为不过期")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+
+
+def server_from_args(args: argparse.Namespace, files: int) -> FakeQuarkServer:
+    return FakeQuarkServer(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        max_page_size=args.max_page_size,
+        files=files,
+        dirs=args.dirs,
+        files_per_dir=args.files_per_dir,
+        root_folder=args.root_folder,
+        task_polls=args.task_polls,
+        save_limit=args.save_limit,
+        stoken_ttl=args.stoken_ttl,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="夸克网盘接口本地模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8848)
+    parser.add_argument("--files", type=int, default=50, help="每个分享根目录下的文件数")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    server = server_from_args(args, args.files)
+    print(f"模拟服务已启动: http://{args.host}:{args.port}  (统计: /__stats)")
+    web.run_app(server.make_app(), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,16 +6,26 @@
 
 import os
 import re
+import ssl
 import sys
 import json
+import math
+import hashlib
+import inspect
+import itertools
+import posixpath
 import time
 import random
 import asyncio
 import aiohttp
 import logging
-from datetime import datetime
-from functools import lru_cache
-from typing import Dict, List, Any, Optional, Tuple, Union
+import contextvars
+from collections import deque
+from datetime import date, datetime
+from contextlib import asynccontextmanager
+from functools import lru_cache, wraps
+from urllib.parse import urlsplit
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Any, Optional, Set, Tuple, Union
 
 # 兼容青龙
 try:
@@ -25,8 +35,56 @@ except ImportError:
     from treelib.tree import Tree
 
 CONFIG_DATA: Dict[str, Any] = {}
-NOTIFYS: List[str] = []
+TIMED_OUT_TASKS: List[str] = []
 GH_PROXY = os.environ.get("GH_PROXY", "https://ghproxy.net/")
+# 接口地址，可通过环境变量指向本地模拟服务（见 fake_quark_server.py）
+QUARK_API_BASE = os.environ.get("QUARK_API_BASE", "https://drive-pc.quark.cn").rstrip("/")
+QUARK_PAN_BASE = os.environ.get("QUARK_PAN_BASE", os.environ.get("QUARK_API_BASE", "https://pan.quark.cn")).rstrip("/")
+
+# 连接池参数（create_session 使用）
+HTTP_LIMIT = int(os.environ.get("QUARK_HTTP_LIMIT", "100"))
+HTTP_LIMIT_PER_HOST = int(os.environ.get("QUARK_HTTP_LIMIT_PER_HOST", "10"))
+HTTP_KEEPALIVE = float(os.environ.get("QUARK_HTTP_KEEPALIVE", "60"))
+HTTP_DNS_TTL = int(os.environ.get("QUARK_HTTP_DNS_TTL", "600"))
+HTTP_TIMEOUT = float(os.environ.get("QUARK_HTTP_TIMEOUT", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("QUARK_HTTP_CONNECT_TIMEOUT", "10"))
+# 时间预算（秒，0 表示不限制）：单个转存任务、整次运行；单次请求上限即 HTTP_TIMEOUT
+TASK_TIMEOUT = float(os.environ.get("QUARK_TASK_TIMEOUT", "1800"))
+RUN_TIMEOUT = float(os.environ.get("QUARK_RUN_TIMEOUT", "7200"))
+# 分页接口每页条数，以及单个列表并发获取的页数上限
+DETAIL_PAGE_SIZE = 50
+# 目录列表（file/sort）按顺序尝试的页大小，接口拒绝时退到下一个
+LS_PAGE_SIZES = tuple(sorted((int(s) for s in os.environ.get("QUARK_LS_PAGE_SIZES", "500,200,100,50").split(",") if s.strip()), reverse=True))
+PAGE_CONCURRENCY = int(os.environ.get("QUARK_PAGE_CONCURRENCY", "4"))
+# 批量建目录时同一层级并发的 mkdir 请求数
+MKDIR_CONCURRENCY = int(os.environ.get("QUARK_MKDIR_CONCURRENCY", "4"))
+# 分块转存：每块的文件数，以及同时提交的块数
+SAVE_CHUNK_SIZE = int(os.environ.get("QUARK_SAVE_CHUNK_SIZE", "100"))
+SAVE_CONCURRENCY = int(os.environ.get("QUARK_SAVE_CONCURRENCY", "2"))
+# update_subdir 任务同时处理的子目录数，以及向下遍历的最大层数
+SUBDIR_CONCURRENCY = int(os.environ.get("QUARK_SUBDIR_CONCURRENCY", "4"))
+SUBDIR_MAX_DEPTH = int(os.environ.get("QUARK_SUBDIR_MAX_DEPTH", "8"))
+# 单个账号同时执行的转存任务数，以及同时处理的账号数
+TASK_CONCURRENCY = int(os.environ.get("QUARK_TASK_CONCURRENCY", "4"))
+ACCOUNT_CONCURRENCY = int(os.environ.get("QUARK_ACCOUNT_CONCURRENCY", "3"))
+# path_list 单次请求的路径数上限
+PATH_LIST_BATCH = 50
+# 增量读取分享列表：翻页到任务上次记录的水位即停止，设为 0 关闭
+INCREMENTAL_LISTING = os.environ.get("QUARK_INCREMENTAL_LISTING", "1") != "0"
+# 连续增量读取这么多次后完整读取一次，补上水位之前的缺口；设为 0 则只在目标目录有变化时完整读取
+WATERMARK_FULL_SCAN = int(os.environ.get("QUARK_WATERMARK_FULL_SCAN", "10"))
+
+# 响应体 JSON 解析后端：安装了 orjson 就用 orjson，否则用标准库；可用 QUARK_JSON_BACKEND 强制指定
+JSON_BACKENDS: Dict[str, Callable[[bytes], Any]] = {"json": json.loads}
+try:
+    import orjson
+    JSON_BACKENDS["orjson"] = orjson.loads
+except ImportError:
+    pass
+JSON_BACKEND = os.environ.get("QUARK_JSON_BACKEND", "orjson" if "orjson" in JSON_BACKENDS else "json")
+if JSON_BACKEND not in JSON_BACKENDS:
+    JSON_BACKEND = "json"
+json_loads = JSON_BACKENDS[JSON_BACKEND]
 
 MAGIC_REGEX: Dict[str, Dict[str, str]] = {
     "$TV": {
@@ -55,51 +113,1027 @@ stream_handler.setFormatter(stream_formatter)
 logger.addHandler(file_handler)
 logger.addHandler(stream_handler)
 
-async def fetch(session: aiohttp.ClientSession, method: str, url: str, **kwargs) -> Optional[Dict[str, Any]]:
+class TaskOutput:
+    """并发执行的任务或账号的输出：任务的日志先缓存，按任务列表顺序整块输出；
+    账号只收集通知（buffer_logs=False），日志照常实时输出"""
+
+    def __init__(self, buffer_logs: bool = True):
+        self.buffer_logs = buffer_logs
+        self.records: List[logging.LogRecord] = []
+        self.notifies: List[str] = []
+
+    def flush(self) -> None:
+        # 日志交给外层（账号不缓存日志，会直接输出），通知并入外层，由账号流程推送
+        parent = TASK_OUTPUT.get()
+        for record in self.records:
+            logger.handle(record)
+        if parent is not None:
+            parent.notifies.extend(self.notifies)
+        self.records, self.notifies = [], []
+
+# 当前协程所属任务或账号的输出，为 None 或不缓存日志时直接输出
+TASK_OUTPUT = contextvars.ContextVar("TASK_OUTPUT", default=None)
+
+class TaskOutputFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        output = TASK_OUTPUT.get()
+        if output is None or not output.buffer_logs:
+            return True
+        output.records.append(record)
+        return False
+
+logger.addFilter(TaskOutputFilter())
+
+_SSL_CONTEXT: Optional[ssl.SSLContext] = None
+
+def _ssl_context() -> ssl.SSLContext:
+    # 进程内共用一个 SSLContext，避免每个会话重复加载 CA 证书
+    global _SSL_CONTEXT
+    if _SSL_CONTEXT is None:
+        _SSL_CONTEXT = ssl.create_default_context()
+    return _SSL_CONTEXT
+
+def create_session(**kwargs) -> aiohttp.ClientSession:
+    """创建带连接池的会话，引擎和各 Web 管理端统一使用
+
+    同一主机的连接数受 HTTP_LIMIT_PER_HOST 限制，空闲连接保持 HTTP_KEEPALIVE 秒，
+    DNS 结果缓存 HTTP_DNS_TTL 秒，批量请求复用少量已完成 TLS 握手的连接。
+    """
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_LIMIT,
+        limit_per_host=HTTP_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE,
+        use_dns_cache=True,
+        ttl_dns_cache=HTTP_DNS_TTL,
+        ssl=_ssl_context(),
+        enable_cleanup_closed=True,
+    )
+    kwargs.setdefault("timeout", aiohttp.ClientTimeout(total=HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT))
+    return aiohttp.ClientSession(connector=connector, **kwargs)
+
+def deadline_after(seconds: float, parent: Optional[float] = None) -> Optional[float]:
+    """返回以 time.monotonic() 为基准的截止时间，seconds<=0 表示不限制；有上级截止时间时取较早者"""
+    deadline = time.monotonic() + seconds if seconds > 0 else None
+    if parent is None:
+        return deadline
+    return parent if deadline is None else min(deadline, parent)
+
+def time_left(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else deadline - time.monotonic()
+
+def check_deadline(deadline: Optional[float], what: str) -> None:
+    # 超时统一抛 asyncio.TimeoutError，由 do_save 记为任务超时
+    if deadline is not None and time.monotonic() >= deadline:
+        raise asyncio.TimeoutError(what)
+
+class TokenBucket:
+    """令牌桶，限流时速率减半，持续成功后逐步恢复到配置上限
+
+    rate <= 0 表示不设上限：平时不排队，第一次遇到限流才按 throttled_rate 开始计速，
+    之后同样减半、恢复，恢复到 throttled_rate 后重新不限速。
+    """
+
+    def __init__(self, rate: float, min_rate: float, ramp_after: int, throttled_rate: float):
+        self.unlimited = rate <= 0
+        self.max_rate = throttled_rate if self.unlimited else rate
+        self.min_rate = min(min_rate, self.max_rate)
+        self.rate = self.max_rate
+        self.limiting = not self.unlimited
+        self.capacity = max(1.0, self.max_rate)
+        self.tokens = self.capacity
+        self.ramp_after = ramp_after
+        self.success_streak = 0
+        self.blocked_until = 0.0
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        while self.limiting:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self) -> None:
+        if not self.limiting:
+            return
+        self.success_streak += 1
+        if self.success_streak < self.ramp_after:
+            return
+        self.success_streak = 0
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.1)
+        elif self.unlimited:
+            self.limiting = False
+
+    def on_throttle(self) -> None:
+        self.success_streak = 0
+        if self.limiting:
+            self.rate = max(self.min_rate, self.rate / 2)
+        else:
+            self.limiting = True
+            self.rate = self.max_rate
+            self.updated_at = time.monotonic()
+        self.tokens = 0
+        self.blocked_until = time.monotonic() + 1 / self.rate
+
+def account_key(kwargs: Dict[str, Any]) -> str:
+    # 签到等接口不带 cookie，用移动端参数区分账号
+    return (kwargs.get("headers") or {}).get("cookie") or str((kwargs.get("params") or {}).get("kps", ""))
+
+class RateGovernor:
+    """按 (账号, 接口类别) 分配令牌桶，读接口和写接口各自独立计速"""
+
+    # 写操作接口，其余夸克接口均按读操作计速
+    WRITE_PATHS = frozenset({
+        "/1/clouddrive/share/sharepage/save",
+        "/1/clouddrive/file",
+        "/1/clouddrive/file/rename",
+        "/1/clouddrive/file/delete",
+        "/1/clouddrive/file/recycle/remove",
+        "/1/clouddrive/capacity/growth/sign",
+    })
+    THROTTLE_KEYWORDS = ("频繁", "too frequent", "rate limit")
+    # 未设上限的接口类别第一次被限流后的起始速率（次/秒）
+    THROTTLED_RATES = {"read": 10.0, "write": 3.0}
+
+    def __init__(self, read_rate: float, write_rate: float, min_rate: float, ramp_after: int):
+        self.rates = {"read": read_rate, "write": write_rate}
+        self.min_rate = min_rate
+        self.ramp_after = ramp_after
+        self.buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+    def bucket(self, url: str, kwargs: Dict[str, Any]) -> Optional[TokenBucket]:
+        if not (url.startswith(QUARK_API_BASE) or url.startswith(QUARK_PAN_BASE)):
+            return None
+        path = urlsplit(url).path
+        endpoint_class = "write" if path in self.WRITE_PATHS else "read"
+        key = (account_key(kwargs), endpoint_class)
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(self.rates[endpoint_class], self.min_rate, self.ramp_after, self.THROTTLED_RATES[endpoint_class])
+        return self.buckets[key]
+
+    def is_throttled(self, response: Optional[Dict[str, Any]]) -> bool:
+        if not response:
+            return False
+        status = response.get("status")
+        if isinstance(status, int) and (status == 429 or status >= 500):
+            return True
+        message = str(response.get("message", ""))
+        return response.get("code") not in (0, None) and any(k in message for k in self.THROTTLE_KEYWORDS)
+
+# 默认不设上限，和不限速时一样快，遇到限流才自动收紧；设为正数则始终按该速率计速
+RATE_GOVERNOR = RateGovernor(
+    read_rate=float(os.environ.get("QUARK_RATE_READ", "0")),
+    write_rate=float(os.environ.get("QUARK_RATE_WRITE", "0")),
+    min_rate=float(os.environ.get("QUARK_RATE_MIN", "0.5")),
+    ramp_after=int(os.environ.get("QUARK_RATE_RAMP_AFTER", "20")),
+)
+
+class RetryPolicy:
+    """只对幂等接口做指数退避重试（带随机抖动），整个运行期共用一个重试预算"""
+
+    # 可安全重放的接口：列表、token、path_list、任务查询等只读请求
+    IDEMPOTENT_PATHS = frozenset({
+        "/account/info",
+        "/1/clouddrive/capacity/growth/info",
+        "/1/clouddrive/share/sharepage/token",
+        "/1/clouddrive/share/sharepage/detail",
+        "/1/clouddrive/file/sort",
+        "/1/clouddrive/file/info/path_list",
+        "/1/clouddrive/file/recycle/list",
+        "/1/clouddrive/task",
+    })
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float, budget: int):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.reset()
+
+    def reset(self) -> None:
+        self.remaining = self.budget
+        self.retries: Dict[str, int] = {}
+        self.gave_up: Dict[str, int] = {}
+        self.budget_exhausted = 0
+
+    def is_idempotent(self, url: str) -> bool:
+        if not (url.startswith(QUARK_API_BASE) or url.startswith(QUARK_PAN_BASE)):
+            return False
+        return urlsplit(url).path in self.IDEMPOTENT_PATHS
+
+    def is_transient(self, response: Optional[Dict[str, Any]]) -> bool:
+        # status 为 -1 表示连接异常或超时，其余按限流/服务端错误判断
+        return bool(response) and (response.get("status") == -1 or RATE_GOVERNOR.is_throttled(response))
+
+    def should_retry(self, path: str, response: Optional[Dict[str, Any]], attempt: int) -> bool:
+        if not self.is_transient(response):
+            return False
+        if attempt + 1 >= self.max_attempts:
+            self.gave_up[path] = self.gave_up.get(path, 0) + 1
+            return False
+        if self.remaining <= 0:
+            self.budget_exhausted += 1
+            self.gave_up[path] = self.gave_up.get(path, 0) + 1
+            return False
+        self.remaining -= 1
+        self.retries[path] = self.retries.get(path, 0) + 1
+        return True
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def summary(self) -> str:
+        total = sum(self.retries.values())
+        detail = "，".join(f"{path.rsplit('/', 1)[-1]}×{count}" for path, count in self.retries.items())
+        text = f"共重试 {total} 次" + (f"（{detail}）" if detail else "")
+        if self.gave_up:
+            text += f"，放弃 {sum(self.gave_up.values())} 次"
+        if self.budget_exhausted:
+            text += f"，重试预算耗尽 {self.budget_exhausted} 次"
+        return text
+
+RETRY_POLICY = RetryPolicy(
+    max_attempts=int(os.environ.get("QUARK_RETRY_ATTEMPTS", "4")),
+    base_delay=float(os.environ.get("QUARK_RETRY_BASE_DELAY", "0.5")),
+    max_delay=float(os.environ.get("QUARK_RETRY_MAX_DELAY", "8")),
+    budget=int(os.environ.get("QUARK_RETRY_BUDGET", "200")),
+)
+
+class RequestMetrics:
+    """按逻辑接口名统计请求次数、耗时分位数、响应字节数和错误码，运行结束时输出 JSON 与 Prometheus 文本"""
+
+    # 未显式指定 endpoint 时，按接口路径推断
+    ENDPOINT_NAMES = {
+        "/account/info": "account_info",
+        "/1/clouddrive/capacity/growth/info": "growth",
+        "/1/clouddrive/capacity/growth/sign": "growth",
+        "/1/clouddrive/share/sharepage/token": "token",
+        "/1/clouddrive/share/sharepage/detail": "detail",
+        "/1/clouddrive/share/sharepage/save": "save",
+        "/1/clouddrive/file/sort": "sort",
+        "/1/clouddrive/file/info/path_list": "path_list",
+        "/1/clouddrive/file": "mkdir",
+        "/1/clouddrive/file/rename": "rename",
+        "/1/clouddrive/file/delete": "delete",
+        "/1/clouddrive/file/recycle/list": "recycle",
+        "/1/clouddrive/file/recycle/remove": "recycle",
+        "/1/clouddrive/task": "task",
+    }
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.latencies: Dict[str, List[float]] = {}
+        self.bytes: Dict[str, int] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+
+    def endpoint_for(self, url: str) -> str:
+        return self.ENDPOINT_NAMES.get(urlsplit(url).path, "other")
+
+    def record(self, endpoint: str, latency: float, nbytes: int, response: Optional[Dict[str, Any]]) -> None:
+        self.latencies.setdefault(endpoint, []).append(latency)
+        self.bytes[endpoint] = self.bytes.get(endpoint, 0) + nbytes
+        code = response.get("code") if isinstance(response, dict) else None
+        if code not in (0, None):
+            errors = self.errors.setdefault(endpoint, {})
+            errors[str(code)] = errors.get(str(code), 0) + 1
+
+    @staticmethod
+    def quantile(sorted_values: List[float], q: float) -> float:
+        # 最近秩法，样本量小时不做插值
+        index = max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))
+        return sorted_values[index]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        result = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            ordered = sorted(values)
+            result[endpoint] = {
+                "count": len(values),
+                "latency_sum_s": round(sum(values), 6),
+                **{f"p{int(q * 100)}_ms": round(self.quantile(ordered, q) * 1000, 2) for q in self.QUANTILES},
+                "response_bytes": self.bytes.get(endpoint, 0),
+                "errors": dict(sorted(self.errors.get(endpoint, {}).items())),
+            }
+        return result
+
+    def summary(self) -> str:
+        snapshot = self.snapshot()
+        if not snapshot:
+            return "无请求"
+        # 按累计耗时排序，最先列出占用时间最多的接口
+        ranked = sorted(snapshot.items(), key=lambda x: -x[1]["latency_sum_s"])
+        return "，".join(
+            f"{endpoint}×{stats['count']} p95={stats['p95_ms']}ms" + (f" 错误{sum(stats['errors'].values())}" if stats["errors"] else "")
+            for endpoint, stats in ranked
+        )
+
+    def prometheus(self) -> str:
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP quark_request_duration_seconds Quark API request latency by endpoint.",
+            "# TYPE quark_request_duration_seconds summary",
+        ]
+        for endpoint, stats in snapshot.items():
+            for q in self.QUANTILES:
+                lines.append(f'quark_request_duration_seconds{{endpoint="{endpoint}",quantile="{q}"}} {stats[f"p{int(q * 100)}_ms"] / 1000}')
+            lines.append(f'quark_request_duration_seconds_sum{{endpoint="{endpoint}"}} {stats["latency_sum_s"]}')
+            lines.append(f'quark_request_duration_seconds_count{{endpoint="{endpoint}"}} {stats["count"]}')
+        lines += [
+            "# HELP quark_response_bytes_total Quark API response body bytes by endpoint.",
+            "# TYPE quark_response_bytes_total counter",
+        ]
+        for endpoint, stats in snapshot.items():
+            lines.append(f'quark_response_bytes_total{{endpoint="{endpoint}"}} {stats["response_bytes"]}')
+        lines += [
+            "# HELP quark_request_errors_total Quark API responses with a non-zero code by endpoint and code.",
+            "# TYPE quark_request_errors_total counter",
+        ]
+        for endpoint, stats in snapshot.items():
+            for code, count in stats["errors"].items():
+                lines.append(f'quark_request_errors_total{{endpoint="{endpoint}",code="{code}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "quark_metrics.json"), "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        # textfile collector 可能随时读取，先写临时文件再原子替换
+        prom_path = os.path.join(directory, "quark_metrics.prom")
+        with open(prom_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(prom_path + ".tmp", prom_path)
+
+REQUEST_METRICS = RequestMetrics()
+METRICS_DIR = os.environ.get("QUARK_METRICS_DIR", ".")
+
+class DiskCache:
+    """跨运行持久化的只读接口缓存：按命名空间存 JSON，超过 TTL 失效，超过体积上限按最近使用时间淘汰
+
+    只有调用 load() 之后才启用，Web 管理端等长驻进程不会意外读到旧数据。
+    """
+
+    def __init__(self, path: str, ttl: float, max_bytes: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.enabled = False
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> None:
+        self.enabled = self.ttl > 0 and self.max_bytes > 0
+        self.hits = self.misses = 0
+        if not self.enabled or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                data = json_loads(f.read())
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取缓存文件失败，本次不使用缓存: {e}")
+            return
+        now = time.time()
+        self.entries = {
+            key: entry for key, entry in data.get("entries", {}).items()
+            if now - entry.get("stored_at", 0) < self.ttl
+        }
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        entry = self.entries.get(f"{namespace}:{key}")
+        if entry is None or time.time() - entry["stored_at"] >= self.ttl:
+            self.misses += 1
+            return None
+        entry["used_at"] = time.time()
+        self.hits += 1
+        self.dirty = True
+        return entry["value"]
+
+    def set(self, namespace: str, key: str, value: Any) -> None:
+        if not self.enabled:
+            return
+        now = time.time()
+        self.entries[f"{namespace}:{key}"] = {
+            "value": value,
+            "stored_at": now,
+            "used_at": now,
+            "size": len(json.dumps(value, ensure_ascii=False)),
+        }
+        self.dirty = True
+
+    def invalidate(self, namespace: str, prefix: str = "") -> None:
+        """删除命名空间里键以 prefix 开头的全部条目"""
+        head = f"{namespace}:{prefix}"
+        for key in [key for key in self.entries if key.startswith(head)]:
+            del self.entries[key]
+            self.dirty = True
+
+    def evict(self) -> None:
+        total = sum(entry["size"] for entry in self.entries.values())
+        if total <= self.max_bytes:
+            return
+        for key, entry in sorted(self.entries.items(), key=lambda x: x[1]["used_at"]):
+            del self.entries[key]
+            total -= entry["size"]
+            if total <= self.max_bytes:
+                break
+
+    def save(self) -> None:
+        if not self.enabled or not self.dirty:
+            return
+        self.evict()
+        try:
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"entries": self.entries}, f, ensure_ascii=False)
+            os.replace(self.path + ".tmp", self.path)
+            self.dirty = False
+        except OSError as e:
+            logger.warning(f"写入缓存文件失败: {e}")
+
+    def summary(self) -> str:
+        return f"命中 {self.hits} 次，未命中 {self.misses} 次，共 {len(self.entries)} 条"
+
+# 分享列表等只读接口的磁盘缓存，TTL 默认 1 天，0 表示关闭
+LISTING_CACHE = DiskCache(
+    path=os.environ.get("QUARK_CACHE_FILE", "quark_cache.json"),
+    ttl=float(os.environ.get("QUARK_CACHE_TTL", "86400")),
+    max_bytes=int(float(os.environ.get("QUARK_CACHE_MAX_MB", "64")) * 1024 * 1024),
+)
+
+class StokenStore:
+    """分享 stoken 缓存：按 (pwd_id, passcode) 保存在内存并写入磁盘，跨任务、跨账号、跨次运行复用
+
+    只有调用 load() 之后才启用：转存引擎用它省掉重复的 token 请求；Web 管理端和链接检查脚本
+    不启用，get_stoken 每次都请求服务端，分享被删除或过期时能立即发现。
+    同时运行的多个引擎进程共用同一个文件，读取前按修改时间判断是否需要重新加载。
+    改动后在线程池里写盘，不阻塞事件循环；写盘期间的新改动由同一次 save() 接着写完。
+    """
+
+    # 分享 token 校验失败或过期时返回的业务码
+    ERROR_CODES = frozenset({41010})
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self.tokens: Dict[str, Dict[str, Any]] = {}
+        self.mtime: Optional[float] = None
+        self.enabled = False
+        self.dirty = False
+        self.pending: Optional[asyncio.Future] = None
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> None:
+        self.enabled = self.ttl > 0
+        self.hits = self.misses = 0
+        if self.enabled:
+            self._reload()
+
+    def _reload(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        try:
+            with open(self.path, "rb") as f:
+                tokens = json_loads(f.read())
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取 stoken 缓存失败: {e}")
+            return
+        self.tokens.update(tokens)
+        self.mtime = mtime
+
+    def _schedule_save(self) -> None:
+        self.dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+        if self.pending is None or self.pending.done():
+            self.pending = loop.run_in_executor(None, self.save)
+
+    def save(self) -> None:
+        while self.dirty:
+            self.dirty = False
+            now = time.time()
+            tokens = {key: entry for key, entry in dict(self.tokens).items() if entry["expires_at"] > now}
+            try:
+                with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(tokens, f, ensure_ascii=False)
+                os.replace(self.path + ".tmp", self.path)
+                self.mtime = os.path.getmtime(self.path)
+            except OSError as e:
+                logger.warning(f"写入 stoken 缓存失败: {e}")
+                return
+
+    async def flush(self) -> None:
+        """等待还在线程池里的写盘完成，运行结束前调用"""
+        if self.pending is not None:
+            await self.pending
+
+    def get(self, pwd_id: str, passcode: str = "") -> Optional[str]:
+        if not self.enabled:
+            return None
+        self._reload()
+        entry = self.tokens.get(f"{pwd_id}:{passcode}")
+        if entry is None or entry["expires_at"] <= time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["stoken"]
+
+    def set(self, pwd_id: str, passcode: str, stoken: str) -> None:
+        if not self.enabled:
+            return
+        self._reload()
+        self.tokens[f"{pwd_id}:{passcode}"] = {"stoken": stoken, "expires_at": time.time() + self.ttl}
+        self._schedule_save()
+
+    def invalidate(self, pwd_id: str, passcode: str = "") -> None:
+        if not self.enabled:
+            return
+        # 先合并其他进程写入的内容，否则之后重新加载会把刚作废的 stoken 读回来
+        self._reload()
+        if self.tokens.pop(f"{pwd_id}:{passcode}", None) is not None:
+            self._schedule_save()
+
+    def is_token_error(self, response: Optional[Dict[str, Any]]) -> bool:
+        return bool(response) and response.get("code") in self.ERROR_CODES
+
+    def summary(self) -> str:
+        return f"命中 {self.hits} 次，未命中 {self.misses} 次"
+
+# stoken 有效期默认 6 小时，0 表示不缓存
+STOKEN_STORE = StokenStore(
+    path=os.environ.get("QUARK_STOKEN_FILE", "quark_stoken.json"),
+    ttl=float(os.environ.get("QUARK_STOKEN_TTL", "21600")),
+)
+
+class PathIndex:
+    """按账号持久化的 保存路径 → fid 索引（同时记录父目录 fid）
+
+    索引里的 fid 不主动校验，只有在列目录或转存失败时才重新解析；重命名、删除时按 fid 失效。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.accounts: Dict[str, Dict[str, Dict[str, str]]] = {}
+        self.enabled = False
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> None:
+        self.enabled = True
+        self.hits = self.misses = 0
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                self.accounts = json_loads(f.read())
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取路径索引失败，本次重新解析: {e}")
+
+    def save(self) -> None:
+        if not self.enabled or not self.dirty:
+            return
+        try:
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.accounts, f, ensure_ascii=False)
+            os.replace(self.path + ".tmp", self.path)
+            self.dirty = False
+        except OSError as e:
+            logger.warning(f"写入路径索引失败: {e}")
+
+    def get(self, account: str, path: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        entry = self.accounts.get(account, {}).get(path)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["fid"]
+
+    def set(self, account: str, path: str, fid: str, pdir_fid: str = "") -> None:
+        if not self.enabled:
+            return
+        self.accounts.setdefault(account, {})[path] = {"fid": fid, "pdir_fid": pdir_fid}
+        self.dirty = True
+
+    def invalidate(self, account: str, path: str) -> None:
+        # 连同子路径一起失效，父目录变了子目录的路径也就不对了
+        paths = self.accounts.get(account, {})
+        for key in [key for key in paths if key == path or key.startswith(path.rstrip("/") + "/")]:
+            del paths[key]
+            self.dirty = True
+
+    def invalidate_fids(self, account: str, fids: List[str]) -> None:
+        fids = set(fids)
+        for path in [path for path, entry in self.accounts.get(account, {}).items() if entry["fid"] in fids]:
+            self.invalidate(account, path)
+
+    def summary(self) -> str:
+        return f"命中 {self.hits} 次，未命中 {self.misses} 次"
+
+PATH_INDEX = PathIndex(os.environ.get("QUARK_PATH_INDEX_FILE", "quark_paths.json"))
+
+def copy_listing(result: Any) -> Any:
+    """多个调用方共享的列表结果各拿一份副本：调用方会在文件字典上写 save_name 等字段"""
+    if isinstance(result, list):
+        return [dict(item) if isinstance(item, dict) else item for item in result]
+    if isinstance(result, dict) and isinstance(result.get("data"), dict) and isinstance(result["data"].get("list"), list):
+        return {**result, "data": {**result["data"], "list": [dict(item) for item in result["data"]["list"]]}}
+    return result
+
+class ShareSnapshots:
+    """一次运行内的分享列表快照
+
+    同一分享的同一页 (stoken, pdir_fid, 页码) 请求成功后保存下来，本次运行的所有任务、所有账号
+    （包括 update_subdir 的子目录递归）共用；失败的响应不保留，下一个调用方会重新请求。
+    这里只保存已完成的页，同一页的并发请求由 _fetch_detail_page 上的 singleflight 合并。
+    只在 main() 的 begin()/end() 之间启用，Web 管理端等长驻进程每次都直接请求；
+    begin() 时按分享登记用到它的任务，最后一个任务 release() 后该分享的页立即丢弃。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self) -> None:
+        self.pages: Dict[str, Dict[Tuple[str, str, int], Dict[str, Any]]] = {}
+        self.consumers: Dict[str, Set[Tuple[int, int]]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.dropped = 0
+
+    def begin(self, tasklists: Dict[int, List[Dict[str, Any]]]) -> None:
+        """tasklists 按账号序号给出本次要执行的任务；旧版配置里各账号共用同一批任务字典，所以按 (账号, 任务) 登记"""
+        self.reset()
+        self.enabled = True
+        for account_index, tasklist in tasklists.items():
+            for task in tasklist:
+                result = Quark.get_id_from_url(task.get("shareurl", ""))
+                if result:
+                    self.consumers.setdefault(result[0], set()).add((account_index, id(task)))
+
+    def release(self, account_index: int, task: Dict[str, Any]) -> None:
+        """任务结束（或确定不会执行）时调用，可重复调用"""
+        result = Quark.get_id_from_url(task.get("shareurl", ""))
+        consumers = self.consumers.get(result[0]) if result else None
+        consumer = (account_index, id(task))
+        if consumers is None or consumer not in consumers:
+            return
+        consumers.discard(consumer)
+        if not consumers:
+            self.consumers.pop(result[0])
+            self.dropped += len(self.pages.pop(result[0], {}))
+
+    def end(self) -> None:
+        self.enabled = False
+        self.pages.clear()
+        self.consumers.clear()
+
+    async def get(self, pwd_id: str, stoken: str, pdir_fid: str, page: int, fetch_page: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return await fetch_page()
+        key = (stoken, pdir_fid, page)
+        response = self.pages.get(pwd_id, {}).get(key)
+        if response is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            response = await fetch_page()
+            # 用到这个分享的任务都已结束时不再保存
+            if not self.is_complete(response) or pwd_id not in self.consumers:
+                return response
+            self.pages.setdefault(pwd_id, {})[key] = response
+        return copy_listing(response)
+
+    @staticmethod
+    def is_complete(response: Optional[Dict[str, Any]]) -> bool:
+        return bool(response) and response.get("code") == 0
+
+    def summary(self) -> str:
+        return f"命中 {self.hits} 页，请求 {self.misses} 页，用完后释放 {self.dropped} 页"
+
+SHARE_SNAPSHOTS = ShareSnapshots()
+
+class CircuitBreaker:
+    """单个 (账号, 接口) 的熔断器：连续失败达到阈值后打开，冷却后放行一个探测请求（半开）"""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self.last_error = ""
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if self.state == "closed":
+            return True
+        if self.state == "open" and now - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+            self.probe_started = 0.0
+        # 半开状态只放行一个探测请求；探测被取消没回来时，超过冷却时间再放一个
+        if self.state == "half_open" and (not self.probe_started or now - self.probe_started >= self.cooldown):
+            self.probe_started = now
+            return True
+        self.rejected += 1
+        return False
+
+    def on_result(self, failed: bool, message: str) -> None:
+        if not failed:
+            self.state = "closed"
+            self.failures = 0
+            return
+        self.failures += 1
+        self.last_error = message
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state == "closed":
+                self.trips += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+class CircuitBreakers:
+    """按 (账号, 逻辑接口名) 管理熔断器，只统计网络异常、限流/服务端错误和登录失效"""
+
+    # 夸克 cookie 失效时返回的业务码
+    AUTH_ERROR_CODES = frozenset({31001})
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def reset(self) -> None:
+        self.breakers.clear()
+
+    def get(self, url: str, kwargs: Dict[str, Any], endpoint: str) -> Optional[CircuitBreaker]:
+        if self.threshold <= 0 or not (url.startswith(QUARK_API_BASE) or url.startswith(QUARK_PAN_BASE)):
+            return None
+        key = (account_key(kwargs), endpoint)
+        if key not in self.breakers:
+            self.breakers[key] = CircuitBreaker(self.threshold, self.cooldown)
+        return self.breakers[key]
+
+    @staticmethod
+    def is_local(response: Optional[Dict[str, Any]]) -> bool:
+        """截止时间已到、或单次超时被剩余预算缩短后超时，都是本地原因，不说明接口有问题"""
+        return bool(response) and bool(response.get("local"))
+
+    def is_failure(self, response: Optional[Dict[str, Any]]) -> bool:
+        if not response:
+            return True
+        if response.get("status") in (401, 403) or response.get("code") in self.AUTH_ERROR_CODES:
+            return True
+        return RETRY_POLICY.is_transient(response)
+
+    def tripped(self, account_keys: List[str]) -> List[Tuple[str, CircuitBreaker]]:
+        return [
+            (endpoint, breaker)
+            for (account, endpoint), breaker in self.breakers.items()
+            if account in account_keys and breaker.trips
+        ]
+
+    def report(self, account_keys: List[str]) -> List[str]:
+        return [
+            f"{endpoint}（熔断 {breaker.trips} 次，拦截 {breaker.rejected} 个请求，最后错误: {breaker.last_error[:80]}）"
+            for endpoint, breaker in self.tripped(account_keys)
+        ]
+
+CIRCUIT_BREAKERS = CircuitBreakers(
+    threshold=int(os.environ.get("QUARK_BREAKER_THRESHOLD", "5")),
+    cooldown=float(os.environ.get("QUARK_BREAKER_COOLDOWN", "60")),
+)
+
+class TaskPoller:
+    """转存任务状态轮询服务
+
+    调用方登记 task_id 后各自等待一个 future，所有任务由同一个后台循环调度：首次查询安排在
+    最近任务的典型完成耗时处，未完成再按指数退避，单个任务的查询次数有上限。
+    """
+
+    def __init__(self, min_delay: float, max_delay: float, max_polls: int):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_polls = max_polls
+        self.reset()
+
+    def reset(self) -> None:
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.durations: deque = deque(maxlen=50)
+        self.polls = 0
+        self.completed = 0
+        self.gave_up = 0
+        self._runner: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def expected(self) -> float:
+        """最近完成任务耗时的中位数，还没有样本时用 min_delay"""
+        if not self.durations:
+            return self.min_delay
+        return sorted(self.durations)[len(self.durations) // 2]
+
+    def delay(self, polls: int) -> float:
+        # 第一次在典型耗时处查询；没完成说明比平时慢，从典型耗时的一半起翻倍退避
+        if polls == 0:
+            delay = self.expected()
+        else:
+            delay = max(self.expected() / 2, self.min_delay) * 2 ** (polls - 1)
+        return min(max(delay, self.min_delay), self.max_delay)
+
+    def wait(self, account: "Quark", session: aiohttp.ClientSession, task_id: str, deadline: Optional[float] = None) -> asyncio.Future:
+        """登记一个转存任务，返回最终响应的 future；调用方取消 future 即放弃等待"""
+        loop = asyncio.get_running_loop()
+        now = time.monotonic()
+        future = loop.create_future()
+        self.pending[task_id] = {
+            "account": account,
+            "session": session,
+            "future": future,
+            "deadline": deadline,
+            "submitted": now,
+            "last_poll": now,
+            "next_poll": now + self.delay(0),
+            "polls": 0,
+            # 轮询日志记到登记任务的输出里
+            "output": TASK_OUTPUT.get(),
+        }
+        if self._runner is None or self._runner.done() or self._runner.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            # 后台循环为所有任务服务，不能继承登记任务的输出缓冲
+            self._runner = contextvars.Context().run(asyncio.ensure_future, self._run())
+        self._wakeup.set()
+        return future
+
+    def _resolve(self, task_id: str, response: Optional[Dict[str, Any]]) -> None:
+        entry = self.pending.pop(task_id)
+        if not entry["future"].done():
+            entry["future"].set_result(response)
+
+    async def _run(self) -> None:
+        try:
+            await self._loop()
+        except Exception as e:
+            # 后台循环异常退出时不能让调用方一直等下去
+            logger.error(f"转存任务轮询异常: {e}")
+            for task_id in list(self.pending):
+                self._resolve(task_id, {"code": -1, "message": f"转存任务轮询异常: {e}", "status": -1})
+
+    async def _loop(self) -> None:
+        while self.pending:
+            now = time.monotonic()
+            due = []
+            for task_id, entry in list(self.pending.items()):
+                if entry["future"].done():
+                    # 调用方已取消等待
+                    self.pending.pop(task_id)
+                elif entry["deadline"] is not None and now >= entry["deadline"]:
+                    # 转存任务已提交，只是等不到结果，按失败返回
+                    self._resolve(task_id, {"code": -1, "message": f"等待转存结果超时（task_id={task_id}）", "status": -1})
+                elif entry["next_poll"] <= now:
+                    due.append(task_id)
+            if due:
+                await gather_bounded(self._poll, due, PAGE_CONCURRENCY)
+                continue
+            if not self.pending:
+                break
+            # 睡到最早该查询的任务，期间有新任务登记就提前醒来重新安排
+            next_poll = min(min(entry["next_poll"], entry["deadline"] or entry["next_poll"]) for entry in self.pending.values())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0, next_poll - now))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, task_id: str) -> None:
+        entry = self.pending.get(task_id)
+        if entry is None:
+            return
+        TASK_OUTPUT.set(entry["output"])
+        response = await entry["account"]._task_status(entry["session"], task_id, entry["polls"], entry["deadline"])
+        now = time.monotonic()
+        self.polls += 1
+        entry["polls"] += 1
+        if task_id not in self.pending:
+            return
+        if response and response.get("code") == 0 and response["data"]["status"] == 0:
+            if entry["polls"] == 1:
+                logger.info(f"正在等待[{response['data']['task_title']}]执行结果")
+            if entry["polls"] >= self.max_polls:
+                self.gave_up += 1
+                self._resolve(task_id, {"code": -1, "message": f"转存任务查询 {entry['polls']} 次仍未完成（task_id={task_id}）", "status": -1})
+                return
+            entry["last_poll"] = now
+            entry["next_poll"] = now + self.delay(entry["polls"])
+            return
+        if response and response.get("code") == 0:
+            self.completed += 1
+            # 任务在上次与本次查询之间完成，取中点作为耗时样本
+            self.durations.append((entry["last_poll"] + now) / 2 - entry["submitted"])
+        self._resolve(task_id, response)
+
+    def summary(self) -> str:
+        text = f"完成 {self.completed} 个任务，查询 {self.polls} 次，典型耗时 {self.expected():.1f}s"
+        if self.gave_up:
+            text += f"，{self.gave_up} 个超过查询上限"
+        return text
+
+# 首次查询不早于 0.5 秒，退避间隔最长 10 秒，每个任务最多查询 60 次
+TASK_POLLER = TaskPoller(
+    min_delay=float(os.environ.get("QUARK_TASK_POLL_MIN", "0.5")),
+    max_delay=float(os.environ.get("QUARK_TASK_POLL_MAX", "10")),
+    max_polls=int(os.environ.get("QUARK_TASK_MAX_POLLS", "60")),
+)
+
+async def fetch(session: aiohttp.ClientSession, method: str, url: str, endpoint: Optional[str] = None, deadline: Optional[float] = None, **kwargs) -> Optional[Dict[str, Any]]:
+    endpoint = endpoint or REQUEST_METRICS.endpoint_for(url)
+    breaker = CIRCUIT_BREAKERS.get(url, kwargs, endpoint)
+    if breaker is None:
+        return await _fetch_with_retry(session, method, url, endpoint, deadline, **kwargs)
+    if not breaker.allow():
+        return {"code": -1, "message": f"接口已熔断，暂停请求: {endpoint}（{breaker.last_error[:80]}）", "status": -1, "unsent": True}
+    response = await _fetch_with_retry(session, method, url, endpoint, deadline, **kwargs)
+    if CIRCUIT_BREAKERS.is_local(response):
+        # 不计成功也不计失败；半开状态下的探测没有结论，冷却后再放行一个
+        return response
+    breaker.on_result(CIRCUIT_BREAKERS.is_failure(response), str((response or {}).get("message", "无响应")))
+    if breaker.state == "open":
+        logger.error(f"⛔ 接口连续失败 {breaker.failures} 次，熔断 {breaker.cooldown:.0f}s: {endpoint}")
+    return response
+
+async def _fetch_with_retry(session: aiohttp.ClientSession, method: str, url: str, endpoint: str, deadline: Optional[float], **kwargs) -> Optional[Dict[str, Any]]:
+    bucket = RATE_GOVERNOR.bucket(url, kwargs)
+    retryable = RETRY_POLICY.is_idempotent(url)
+    path = urlsplit(url).path
+    attempt = 0
+    while True:
+        if bucket is not None:
+            await bucket.acquire()
+        remaining = time_left(deadline)
+        if remaining is not None:
+            if remaining <= 0:
+                logger.error(f"请求超出截止时间: {method} {path}")
+                return {"code": -1, "message": f"请求超出截止时间: {method} {path}", "status": -1, "local": True, "unsent": True}
+            # 单次请求的超时不超过剩余预算
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=min(HTTP_TIMEOUT, remaining), connect=HTTP_CONNECT_TIMEOUT)
+        start = time.monotonic()
+        response, nbytes = await _fetch_once(session, method, url, **kwargs)
+        if response and response.get("timeout") and remaining is not None and remaining < HTTP_TIMEOUT:
+            response["local"] = True
+        REQUEST_METRICS.record(endpoint, time.monotonic() - start, nbytes, response)
+        if bucket is not None:
+            if RATE_GOVERNOR.is_throttled(response):
+                bucket.on_throttle()
+                logger.warning(f"接口限流或服务端错误，降速至 {bucket.rate:.2f} 次/秒: {path}")
+            else:
+                bucket.on_success()
+        if not retryable or not RETRY_POLICY.should_retry(path, response, attempt):
+            return response
+        delay = RETRY_POLICY.backoff(attempt)
+        if deadline is not None and time.monotonic() + delay >= deadline:
+            return response
+        attempt += 1
+        logger.warning(f"请求失败，{delay:.2f}s 后第{attempt}次重试: {method} {path}")
+        await asyncio.sleep(delay)
+
+async def _fetch_once(session: aiohttp.ClientSession, method: str, url: str, **kwargs) -> Tuple[Optional[Dict[str, Any]], int]:
+    """发起单次请求，返回 (解析结果, 响应体字节数)"""
     try:
         async with session.request(method, url, **kwargs) as response:
             response.raise_for_status()
-            try:
-                return await response.json()
-            except aiohttp.ContentTypeError:
-                # 如果响应不是JSON，尝试读取原始文本
-                text = await response.text()
-                logger.error(f"响应不是JSON格式: {method} {url} - 响应内容: {text[:200]}")
-                # 尝试解析为JSON，即使Content-Type不正确
-                try:
-                    return json.loads(text)
-                except json.JSONDecodeError:
-                    # 如果仍然无法解析为JSON，返回包含错误信息的字典
-                    return {
-                        "code": -1,
-                        "message": f"响应不是有效的JSON格式: {text[:100]}...",
-                        "raw_response": text[:500]
-                    }
-            except json.JSONDecodeError as e:
-                text = await response.text()
-                logger.error(f"JSON解析错误: {method} {url} - 错误: {e} - 响应内容: {text[:200]}")
-                # 尝试修复常见的JSON格式问题
-                try:
-                    # 尝试修复可能的JSON格式问题
-                    fixed_text = text.strip()
-                    if not fixed_text.startswith('{') and not fixed_text.startswith('['):
-                        # 如果不是以{或[开头，尝试包装它
-                        # 转义字符串中的特殊字符
-                        import json as json_module
-                        escaped_text = json_module.dumps(fixed_text)
-                        fixed_text = f'{{"data": {escaped_text}}}'
-                    return json.loads(fixed_text)
-                except json.JSONDecodeError:
-                    return {
-                        "code": -1,
-                        "message": f"JSON解析失败: {str(e)}",
-                        "raw_response": text[:500]
-                    }
+            # 只读取一次响应体，解析失败时直接复用同一份字节，不再二次读取
+            body = await response.read()
+            content_type = response.headers.get("Content-Type", "")
+        return decode_body(body, content_type, method, url), len(body)
     except aiohttp.ClientResponseError as e:
         # 简化错误处理，不再检查fr参数切换
         url_str = str(url)
         # 如果URL是URL对象，提取实际的URL字符串
-        import re
         url_match = re.search(r"URL\('([^']+)'\)", url_str)
         if url_match:
             url_str = url_match.group(1)
@@ -109,16 +1143,156 @@ async def fetch(session: aiohttp.ClientSession, method: str, url: str, **kwargs)
             "code": e.status,
             "message": f"请求失败: {method} {url_str} - {e}",
             "status": e.status
-        }
+        }, 0
     except Exception as e:
         logger.error(f"请求失败: {method} {url} - {e}")
         # 对于非ClientResponseError异常，返回一个包含错误信息的字典
         return {
             "code": -1,
             "message": f"请求失败: {method} {url} - {e}",
-            "status": -1
+            "status": -1,
+            "timeout": isinstance(e, asyncio.TimeoutError),
+        }, 0
+
+def decode_body(body: bytes, content_type: str, method: str = "", url: str = "") -> Optional[Any]:
+    """解析响应体，失败时返回与原先一致的错误字典"""
+    try:
+        return json_loads(body)
+    except ValueError as e:
+        text = body.decode("utf-8", errors="replace")
+        fixed_text = text.strip()
+        if "json" not in content_type.lower():
+            # Content-Type 不是JSON且内容也无法解析
+            logger.error(f"响应不是JSON格式: {method} {url} - 响应内容: {text[:200]}")
+            return {
+                "code": -1,
+                "message": f"响应不是有效的JSON格式: {text[:100]}...",
+                "raw_response": text[:500]
+            }
+        if not fixed_text:
+            # 与 aiohttp response.json() 一致，空响应体视为 None
+            return None
+        logger.error(f"JSON解析错误: {method} {url} - 错误: {e} - 响应内容: {text[:200]}")
+        if not fixed_text.startswith('{') and not fixed_text.startswith('['):
+            # 如果不是以{或[开头，包装为 {"data": 原始文本}
+            return {"data": fixed_text}
+        return {
+            "code": -1,
+            "message": f"JSON解析失败: {str(e)}",
+            "raw_response": text[:500]
         }
 
+class WatermarkStore:
+    """增量读取分享列表的水位，保存在单独的状态文件里，不写进用户编辑的配置文件
+
+    按 (账号, 分享目录, 保存目录和匹配规则) 记录，用户改了任务配置后自然对不上、不再使用。
+    水位之前的缺口（比如用户删掉了转存过的文件）靠完整读取补上：连续增量读取
+    WATERMARK_FULL_SCAN 次之后，或者目标目录条目数和上次记录的不一致时，都不用水位。
+    只有调用 load() 之后才启用，Web 管理端等长驻进程不会读写。
+    """
+
+    # 长期没有任务用到的水位在保存时清理
+    MAX_AGE = 30 * 86400
+
+    def __init__(self, path: str):
+        self.path = path
+        self.marks: Dict[str, Dict[str, Any]] = {}
+        self.enabled = False
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.full_scans = 0
+
+    def load(self) -> None:
+        self.enabled = INCREMENTAL_LISTING
+        self.hits = self.misses = self.full_scans = 0
+        if not self.enabled or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                self.marks = json_loads(f.read())
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取水位文件失败，本次完整读取分享列表: {e}")
+
+    def save(self) -> None:
+        if not self.enabled or not self.dirty:
+            return
+        now = time.time()
+        self.marks = {key: mark for key, mark in self.marks.items() if now - mark.get("stored_at", 0) < self.MAX_AGE}
+        try:
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.marks, f, ensure_ascii=False)
+            os.replace(self.path + ".tmp", self.path)
+            self.dirty = False
+        except OSError as e:
+            logger.warning(f"写入水位文件失败: {e}")
+
+    @staticmethod
+    def key(account: str, task: Dict[str, Any], pwd_id: str, pdir_fid: str) -> str:
+        scope = [
+            account, pwd_id, pdir_fid,
+            task.get("savepath"), task.get("pattern"), task.get("replace"), task.get("startfid"),
+            bool(task.get("ignore_extension")), bool(task.get("update_subdir")),
+        ]
+        return hashlib.sha1(json.dumps(scope, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, account: str, task: Dict[str, Any], pwd_id: str, pdir_fid: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        mark = self.marks.get(self.key(account, task, pwd_id, pdir_fid))
+        if mark is None:
+            self.misses += 1
+            return None
+        if WATERMARK_FULL_SCAN > 0 and mark.get("runs", 0) >= WATERMARK_FULL_SCAN:
+            self.full_scans += 1
+            return None
+        self.hits += 1
+        return mark
+
+    def changed(self, mark: Optional[Dict[str, Any]], target_count: int) -> bool:
+        """目标目录条目数和上次推进水位时不同，说明两次运行之间有增删，本次应完整读取"""
+        if mark is None or mark.get("target_count") == target_count:
+            return False
+        self.hits -= 1
+        self.full_scans += 1
+        return True
+
+    @staticmethod
+    def since(mark: Optional[Dict[str, Any]]) -> Optional[Tuple[int, str]]:
+        return (mark["updated_at"], mark["fid"]) if mark else None
+
+    def set(self, account: str, task: Dict[str, Any], pwd_id: str, pdir_fid: str, file_list: List[Dict[str, Any]], mark: Optional[Dict[str, Any]], target_count: int) -> None:
+        """mark 是本次读取用的水位，为 None 表示本次是完整读取，增量计数从头开始"""
+        files = [item for item in file_list if not item["dir"]]
+        if not self.enabled or not files:
+            return
+        newest = max(files, key=lambda item: item["updated_at"])
+        self.marks[self.key(account, task, pwd_id, pdir_fid)] = {
+            "updated_at": newest["updated_at"],
+            "fid": newest["fid"],
+            "runs": 0 if mark is None else mark.get("runs", 0) + 1,
+            "target_count": target_count,
+            "stored_at": time.time(),
+        }
+        self.dirty = True
+
+    def summary(self) -> str:
+        return f"命中 {self.hits} 次，未命中 {self.misses} 次，完整读取 {self.full_scans} 次"
+
+WATERMARKS = WatermarkStore(os.environ.get("QUARK_WATERMARK_FILE", "quark_watermarks.json"))
+
+def listing_fingerprint(file_list: List[Dict[str, Any]], total: Optional[int] = None) -> str:
+    """分享列表一页的指纹：任一条目的 fid、名称、修改时间或 share_fid_token 变化都会改变"""
+    items = [[item.get("fid"), item.get("file_name"), item.get("updated_at"), item.get("share_fid_token")] for item in file_list]
+    return hashlib.sha1(json.dumps([total, items], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def reached_watermark(file_list: List[Dict[str, Any]], since: Optional[Tuple[int, str]]) -> bool:
+    """列表按 file_type:asc,updated_at:desc 排序，文件夹总在前面，只有文件能判断是否已到水位"""
+    if not since:
+        return False
+    updated_at, fid = since
+    return any(not item["dir"] and (item["updated_at"] <= updated_at or item["fid"] == fid) for item in file_list)
+
 def magic_regex_func(pattern: str, replace: str) -> Tuple[str, str]:
     keyword = pattern
     # 检查CONFIG_DATA是否已初始化并且包含magic_regex
@@ -128,6 +1302,98 @@ def magic_regex_func(pattern: str, replace: str) -> Tuple[str, str]:
             replace = CONFIG_DATA["magic_regex"][keyword]["replace"]
     return pattern, replace
 
+class TaskPlan:
+    """任务配置编译成的执行计划：magic_regex 已展开、正则已编译、日期已解析，匹配每个文件时直接使用"""
+
+    def __init__(self, task: Dict[str, Any]):
+        self.savepath = re.sub(r"/{2,}", "/", f"/{task['savepath']}")
+        if "pattern" not in task:
+            # 如果没有pattern字段，则匹配所有文件
+            pattern, replace = ".*", ""
+        else:
+            pattern, replace = magic_regex_func(task["pattern"], task.get("replace", ""))
+        self.pattern = re.compile(pattern)
+        self.replace = replace
+        self.subdir_pattern = re.compile(task["update_subdir"]) if task.get("update_subdir") else None
+        # 配置里同时有 pattern 和 replace、且展开后都不为空才重命名
+        self.renames = "pattern" in task and "replace" in task and bool(pattern) and bool(replace)
+        self.ignore_extension = bool(task.get("ignore_extension"))
+        self.enddate = datetime.strptime(task["enddate"], "%Y-%m-%d").date() if task.get("enddate") else None
+        self.runweek = frozenset(task.get("runweek") or ())
+
+    def path(self, subdir_path: str = "") -> str:
+        return re.sub(r"/{2,}", "/", f"{self.savepath}{subdir_path}") if subdir_path else self.savepath
+
+    def active(self, today: date) -> bool:
+        return self.enddate is None or today <= self.enddate
+
+    def due(self, today: date) -> bool:
+        # runweek 里周一为 1
+        return self.active(today) and (not self.runweek or today.weekday() + 1 in self.runweek)
+
+    def save_name(self, file_name: str, is_dir: bool = False) -> Optional[str]:
+        """分享里的条目匹配时返回转存后的名称，不匹配返回 None；设置了 update_subdir 时文件夹按它匹配，不改名"""
+        if is_dir and self.subdir_pattern is not None:
+            pattern, replace = self.subdir_pattern, ""
+        else:
+            pattern, replace = self.pattern, self.replace
+        if not pattern.search(file_name):
+            return None
+        return pattern.sub(replace, file_name) if replace != "" else file_name
+
+    def rename_to(self, file_name: str) -> Optional[str]:
+        if not self.renames or not self.pattern.search(file_name):
+            return None
+        return self.pattern.sub(self.replace, file_name)
+
+class TaskPlans:
+    """按配置版本缓存 TaskPlan：任务的相关字段或所用的 magic_regex 一变就重新编译，否则跨文件、子目录和多次运行复用"""
+
+    MAX_PLANS = 4096
+
+    def __init__(self):
+        self.plans: Dict[Tuple[Any, ...], TaskPlan] = {}
+        self.compiled = 0
+        self.reused = 0
+
+    def reset_stats(self) -> None:
+        # 只清统计，已编译的计划留给后续运行
+        self.compiled = 0
+        self.reused = 0
+
+    @staticmethod
+    def version(task: Dict[str, Any]) -> Tuple[Any, ...]:
+        magic = (CONFIG_DATA.get("magic_regex") or {}).get(task.get("pattern")) if CONFIG_DATA else None
+        return (
+            task["savepath"],
+            "pattern" in task,
+            task.get("pattern"),
+            "replace" in task,
+            task.get("replace"),
+            task.get("update_subdir") or "",
+            bool(task.get("ignore_extension")),
+            task.get("enddate") or "",
+            tuple(task.get("runweek") or ()),
+            (magic.get("pattern"), magic.get("replace")) if isinstance(magic, dict) else None,
+        )
+
+    def get(self, task: Dict[str, Any]) -> TaskPlan:
+        key = self.version(task)
+        plan = self.plans.get(key)
+        if plan is not None:
+            self.reused += 1
+            return plan
+        if len(self.plans) >= self.MAX_PLANS:
+            self.plans.clear()
+        plan = self.plans[key] = TaskPlan(task)
+        self.compiled += 1
+        return plan
+
+    def summary(self) -> str:
+        return f"编译 {self.compiled} 个，复用 {self.reused} 次"
+
+TASK_PLANS = TaskPlans()
+
 def send_ql_notify(title: str, body: str, cookie_index: Optional[int] = None) -> None:
     try:
         import notify
@@ -207,8 +1473,9 @@ def send_ql_notify(title: str, body: str, cookie_index: Optional[int] = None) ->
         logger.error(f"发送通知消息失败: {e}")
 
 def add_notify(text: str) -> str:
-    global NOTIFYS
-    NOTIFYS.append(text)
+    output = TASK_OUTPUT.get()
+    if output is not None:
+        output.notifies.append(text)
     logger.info(text)
     return text
 
@@ -238,6 +1505,157 @@ def get_cookies(cookie_val: Union[str, List[str], None]) -> Union[List[str], boo
     else:
         return False
 
+async def gather_bounded(func: Callable[[Any], Awaitable[Any]], items: List[Any], limit: int) -> List[Any]:
+    """对每个元素调用 func，最多 limit 个同时进行，结果按 items 顺序返回"""
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(item: Any) -> Any:
+        async with semaphore:
+            return await func(item)
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+async def stream_pages(fetch_page: Callable[[int], Awaitable[Optional[List[Dict[str, Any]]]]], pages: Iterable[int], limit: int) -> AsyncIterator[Optional[List[Dict[str, Any]]]]:
+    """按页码顺序逐页产出，最多提前获取 limit 页；调用方停止读取时取消尚未完成的请求"""
+    pages = iter(pages)
+    pending = deque(asyncio.ensure_future(fetch_page(page)) for page in itertools.islice(pages, max(1, limit)))
+    try:
+        while pending:
+            result = await pending.popleft()
+            # 消费一页才补发一页，调用方处理得慢时内存里也只积压 limit 页
+            page = next(pages, None)
+            if page is not None:
+                pending.append(asyncio.ensure_future(fetch_page(page)))
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def collect_pages(pages: AsyncIterator[Optional[List[Dict[str, Any]]]]) -> Optional[List[Dict[str, Any]]]:
+    """把逐页产出的列表拼成完整列表，任一页失败返回 None"""
+    items = []
+    try:
+        async for page_list in pages:
+            if page_list is None:
+                return None
+            items += page_list
+    finally:
+        await pages.aclose()
+    return items
+
+class PathLocks:
+    """保存目录互斥：同一目录或有上下级关系的目录，同一时间只允许一个任务写入"""
+
+    def __init__(self):
+        self.held: List[str] = []
+        self.condition = asyncio.Condition()
+
+    @staticmethod
+    def overlaps(a: str, b: str) -> bool:
+        a, b = a.rstrip("/") + "/", b.rstrip("/") + "/"
+        return a.startswith(b) or b.startswith(a)
+
+    @asynccontextmanager
+    async def hold(self, path: str):
+        async with self.condition:
+            await self.condition.wait_for(lambda: not any(self.overlaps(path, held) for held in self.held))
+            self.held.append(path)
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.held.remove(path)
+                self.condition.notify_all()
+
+# 当前协程占用的子目录遍历名额，等待下层子目录时让出
+SUBDIR_SLOT = contextvars.ContextVar("SUBDIR_SLOT", default=None)
+
+class SubdirWalk:
+    """update_subdir 的子目录遍历：一个任务内最多 SUBDIR_CONCURRENCY 个子目录同时处理，
+    分享里已访问过的目录不再进入，避免接口返回异常结构时无限递归"""
+
+    def __init__(self, root_fid: str):
+        self.limit = asyncio.Semaphore(max(1, SUBDIR_CONCURRENCY))
+        self.seen: Set[str] = {root_fid}
+        # 任一层目录读取或转存失败，顶层就不推进水位，下次仍从旧水位开始读
+        self.failed = False
+
+    def visit(self, fid: str) -> bool:
+        if fid in self.seen:
+            return False
+        self.seen.add(fid)
+        return True
+
+    def spawn(self, coro: Awaitable[Tree]) -> asyncio.Future:
+        return asyncio.ensure_future(self._run(coro))
+
+    async def _run(self, coro: Awaitable[Tree]) -> Tree:
+        slot = {"held": False}
+        SUBDIR_SLOT.set(slot)
+        try:
+            await self.limit.acquire()
+            slot["held"] = True
+            return await coro
+        finally:
+            # 排队时被取消的协程没有启动过，关掉以免告警
+            coro.close()
+            self.release(slot)
+
+    def release(self, slot: Dict[str, bool]) -> None:
+        if slot["held"]:
+            slot["held"] = False
+            self.limit.release()
+
+    async def join(self, futures: List[asyncio.Future]) -> List[Tree]:
+        if not futures:
+            return []
+        slot = SUBDIR_SLOT.get()
+        if slot is not None:
+            # 本层已处理完，等下层时让出名额，否则深层目录会占满名额互相等待
+            self.release(slot)
+        return await asyncio.gather(*futures)
+
+class NameIndex:
+    """目标目录已有条目的索引：原名、去后缀名、子目录 fid，判断文件是否已存在只需哈希查找"""
+
+    def __init__(self, file_list: Iterable[Dict[str, Any]]):
+        self.names: Set[str] = set()
+        self.stems: Set[str] = set()
+        self.dirs: Dict[str, str] = {}
+        for item in file_list:
+            name = item["file_name"]
+            self.names.add(name)
+            self.stems.add(os.path.splitext(name)[0])
+            if item["dir"]:
+                self.dirs[name] = item["fid"]
+
+    def exists(self, file_name: str, save_name: str, ignore_extension: bool = False) -> bool:
+        # 原名或转存后的新名任一已存在即视为已转存；忽略后缀时只比较去掉后缀的部分
+        if ignore_extension:
+            return os.path.splitext(file_name)[0] in self.stems or os.path.splitext(save_name)[0] in self.stems
+        return file_name in self.names or save_name in self.names
+
+def singleflight(method):
+    """同一 Quark 实例上参数相同的并发调用只发一次请求，其余调用方等待同一结果"""
+    signature = inspect.signature(method)
+
+    @wraps(method)
+    async def wrapper(self, session: aiohttp.ClientSession, *args, **kwargs):
+        # 位置参数、关键字参数和默认值统一按参数名排列，写法不同的同一调用也能合并
+        bound = signature.bind(self, session, *args, **kwargs)
+        bound.apply_defaults()
+        key = (method.__name__, tuple(bound.arguments.items())[2:])
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            # 后来者拿副本，避免互相覆盖
+            return copy_listing(await asyncio.shield(inflight))
+        # 用独立任务承载请求，发起者被取消时其余等待者仍能拿到结果
+        inflight = asyncio.ensure_future(method(self, session, *args, **kwargs))
+        self._inflight[key] = inflight
+        inflight.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(inflight)
+    return wrapper
+
 class Quark:
     def __init__(self, cookie: str, index: Optional[int] = None):
         self.cookie = cookie.strip()
@@ -247,6 +1665,19 @@ class Quark:
         self.st = self.match_st_form_cookie(cookie)
         self.mparam = self.match_mparam_form_cookie(cookie)
         self.savepath_fid = {"/": "0"}
+        # 持久化路径索引按 __uid 区分账号，cookie 刷新后仍能命中；取不到时用 cookie 摘要
+        uid_match = re.search(r"__uid=([^;]+)", cookie)
+        self.uid = uid_match.group(1) if uid_match else hashlib.sha1(self.cookie.encode()).hexdigest()[:16]
+        # 本次运行从索引取出、尚未实际用过的路径，出错时才需要重新解析
+        self.unverified_paths = set()
+        self.ls_page_size = LS_PAGE_SIZES[0]
+        # 页大小成功用过一次后不再串行协商；锁在事件循环里按需创建
+        self.ls_page_size_settled = False
+        self._ls_negotiation: Optional[asyncio.Lock] = None
+        # get_fids 的结果缓存，键为查询的路径元组；目录变动后用 invalidate_fids 丢弃
+        self._fids_cache: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        # singleflight 使用的进行中请求表，键为 (方法名, 参数)
+        self._inflight: Dict[Tuple[str, Tuple[Any, ...]], asyncio.Future] = {}
 
     def match_st_form_cookie(self, cookie: str) -> str:
         # 修复正则表达式：匹配 =stxxxxxx; 格式
@@ -268,6 +1699,10 @@ class Quark:
             }
         return mparam
 
+    def account_keys(self) -> List[str]:
+        # 与 account_key() 一致：网页端接口按 cookie 区分，签到接口按 kps 区分
+        return [self.cookie, self.mparam.get("kps", "")]
+
     def common_headers(self) -> Dict[str, str]:
         headers = {
             "cookie": self.cookie,
@@ -287,17 +1722,17 @@ class Quark:
             return False
 
     async def get_account_info(self, session: aiohttp.ClientSession) -> Union[Dict[str, Any], bool]:
-        url = "https://pan.quark.cn/account/info"
+        url = f"{QUARK_PAN_BASE}/account/info"
         querystring = {"fr": "pc", "platform": "pc"}
         headers = self.common_headers()
-        response = await fetch(session, "GET", url, headers=headers, params=querystring)
+        response = await fetch(session, "GET", url, endpoint="account_info", headers=headers, params=querystring)
         if response and response.get("data"):
             return response["data"]
         else:
             return False
 
     async def get_growth_info(self, session: aiohttp.ClientSession) -> Union[Dict[str, Any], bool]:
-        url = "https://drive-pc.quark.cn/1/clouddrive/capacity/growth/info"
+        url = f"{QUARK_API_BASE}/1/clouddrive/capacity/growth/info"
         querystring = {
             "pr": "ucpro",
             "fr": "android",
@@ -308,14 +1743,14 @@ class Quark:
         headers = {
             "content-type": "application/json",
         }
-        response = await fetch(session, "GET", url, headers=headers, params=querystring)
+        response = await fetch(session, "GET", url, endpoint="growth", headers=headers, params=querystring)
         if response and response.get("data"):
             return response["data"]
         else:
             return False
 
     async def get_growth_sign(self, session: aiohttp.ClientSession) -> Tuple[bool, Union[int, str]]:
-        url = "https://drive-pc.quark.cn/1/clouddrive/capacity/growth/sign"
+        url = f"{QUARK_API_BASE}/1/clouddrive/capacity/growth/sign"
         querystring = {
             "pr": "ucpro",
             "fr": "android",
@@ -329,7 +1764,7 @@ class Quark:
         headers = {
             "content-type": "application/json",
         }
-        response = await fetch(session, "POST", url, json=payload, headers=headers, params=querystring)
+        response = await fetch(session, "POST", url, endpoint="growth", json=payload, headers=headers, params=querystring)
         if response and response.get("data"):
             return True, response["data"]["sign_daily_reward"]
         elif response:
@@ -337,7 +1772,8 @@ class Quark:
         else:
             return False, "未知错误"
 
-    def get_id_from_url(self, url: str) -> Union[Tuple[str, str], None]:
+    @staticmethod
+    def get_id_from_url(url: str) -> Union[Tuple[str, str], None]:
         url = url.replace("https://pan.quark.cn/s/", "")
         pattern = r"(\w+)(#/list/share.*/(\w+))?"
         match = re.search(pattern, url)
@@ -351,14 +1787,21 @@ class Quark:
         else:
             return None
 
-    async def get_stoken(self, session: aiohttp.ClientSession, pwd_id: str) -> Tuple[bool, str]:
-        url = "https://drive-pc.quark.cn/1/clouddrive/share/sharepage/token"
+    @singleflight
+    async def get_stoken(self, session: aiohttp.ClientSession, pwd_id: str, passcode: str = "") -> Tuple[bool, str]:
+        # 转存引擎运行时同一分享的 stoken 在任务、账号之间共用，过期或被拒绝时由调用方 refresh_stoken；
+        # 缓存未启用（Web 管理端、链接检查）时每次都向服务端确认分享是否有效
+        stoken = STOKEN_STORE.get(pwd_id, passcode)
+        if stoken:
+            return True, stoken
+        url = f"{QUARK_API_BASE}/1/clouddrive/share/sharepage/token"
         querystring = {"pr": "ucpro", "fr": "pc"}
-        payload = {"pwd_id": pwd_id, "passcode": ""}
+        payload = {"pwd_id": pwd_id, "passcode": passcode}
         headers = self.common_headers()
-        response = await fetch(session, "POST", url, json=payload, headers=headers, params=querystring)
+        response = await fetch(session, "POST", url, endpoint="token", json=payload, headers=headers, params=querystring)
         if response:
             if response.get("data"):
+                STOKEN_STORE.set(pwd_id, passcode, response["data"]["stoken"])
                 return True, response["data"]["stoken"]
             elif response.get("message"):
                 # 确保消息是字符串且不包含可能破坏JSON的字符
@@ -379,93 +1822,237 @@ class Quark:
         else:
             return False, "请求失败或无响应"
 
-    async def get_detail(self, session: aiohttp.ClientSession, pwd_id: str, stoken: str, pdir_fid: str) -> List[Dict[str, Any]]:
-        file_list = []
-        page = 1
-        while True:
-            url = "https://drive-pc.quark.cn/1/clouddrive/share/sharepage/detail"
-            querystring = {
-                "pr": "ucpro",
-                "fr": "pc",
-                "pwd_id": pwd_id,
-                "stoken": stoken,
-                "pdir_fid": pdir_fid,
-                "force": "0",
-                "_page": page,
-                "_size": "50",
-                "_fetch_banner": "0",
-                "_fetch_share": "0",
-                "_fetch_total": "1",
-                "_sort": "file_type:asc,updated_at:desc",
-            }
-            headers = self.common_headers()
-            response = await fetch(session, "GET", url, headers=headers, params=querystring)
-            if response and response["data"]["list"]:
-                file_list += response["data"]["list"]
-                page += 1
-            else:
-                break
-            if len(file_list) >= response["metadata"]["_total"]:
-                break
-        return file_list
+    async def refresh_stoken(self, session: aiohttp.ClientSession, pwd_id: str, passcode: str = "") -> Tuple[bool, str]:
+        logger.info(f"分享 stoken 已失效，重新获取: {pwd_id}")
+        STOKEN_STORE.invalidate(pwd_id, passcode)
+        return await self.get_stoken(session, pwd_id, passcode)
+
+    async def _detail_page(self, session: aiohttp.ClientSession, pwd_id: str, stoken: str, pdir_fid: str, page: int) -> Optional[Dict[str, Any]]:
+        return await SHARE_SNAPSHOTS.get(pwd_id, stoken, pdir_fid, page, lambda: self._fetch_detail_page(session, pwd_id, stoken, pdir_fid, page))
+
+    @singleflight
+    async def _fetch_detail_page(self, session: aiohttp.ClientSession, pwd_id: str, stoken: str, pdir_fid: str, page: int) -> Optional[Dict[str, Any]]:
+        url = f"{QUARK_API_BASE}/1/clouddrive/share/sharepage/detail"
+        querystring = {
+            "pr": "ucpro",
+            "fr": "pc",
+            "pwd_id": pwd_id,
+            "stoken": stoken,
+            "pdir_fid": pdir_fid,
+            "force": "0",
+            "_page": page,
+            "_size": str(DETAIL_PAGE_SIZE),
+            "_fetch_banner": "0",
+            "_fetch_share": "0",
+            "_fetch_total": "1",
+            "_sort": "file_type:asc,updated_at:desc",
+        }
+        headers = self.common_headers()
+        response = await fetch(session, "GET", url, endpoint="detail", headers=headers, params=querystring)
+        if not response or response.get("code") != 0:
+            logger.error(f"获取分享详情失败: {response.get('message') if response else '无响应'}")
+        return response
+
+    async def iter_detail(self, session: aiohttp.ClientSession, pwd_id: str, stoken: str, pdir_fid: str, since: Optional[Tuple[int, str]] = None, passcode: str = "") -> AsyncIterator[Optional[List[Dict[str, Any]]]]:
+        """按页码顺序逐页产出分享目录列表，调用方处理当前页时后续页已在获取；某页失败时产出 None 并结束
+
+        since 为上次成功运行记下的 (updated_at, fid) 水位，给出时产出水位所在页后即停止翻页
+        """
+        # 其他任务可能已经刷新过同一分享的 stoken，优先用最新的
+        stoken = STOKEN_STORE.get(pwd_id, passcode) or stoken
+        response = await self._detail_page(session, pwd_id, stoken, pdir_fid, 1)
+        if STOKEN_STORE.is_token_error(response):
+            is_sharing, new_stoken = await self.refresh_stoken(session, pwd_id, passcode)
+            if is_sharing:
+                stoken = new_stoken
+                response = await self._detail_page(session, pwd_id, stoken, pdir_fid, 1)
+        elif response and response.get("code") != 0 and not RETRY_POLICY.is_transient(response):
+            # 分享失效而 stoken 仍在缓存里时也会报错，只清掉缓存，下次运行 get_stoken 会直接报告失效原因
+            STOKEN_STORE.invalidate(pwd_id, passcode)
+        if not response or response.get("code") != 0:
+            yield None
+            return
+        first_list = response["data"]["list"]
+        total = response["metadata"]["_total"]
+        # 第一页存一份清单：stoken、第一页和总数的指纹、其余各页的指纹。stoken 和第一页都没变时，
+        # 其余页只在指纹与清单一致时取缓存；share_fid_token 跟着 stoken 走，换了 stoken 一律重新请求
+        manifest_key = f"{pwd_id}/{pdir_fid}/1"
+        version = listing_fingerprint(first_list, total)
+        cached = LISTING_CACHE.get("detail", manifest_key)
+        use_cache = cached is not None and cached.get("stoken") == stoken and cached.get("version") == version
+        manifest = {"stoken": stoken, "version": version, "pages": dict(cached["pages"]) if use_cache else {}}
+        LISTING_CACHE.set("detail", manifest_key, manifest)
+        yield first_list
+        if not first_list or len(first_list) >= total or reached_watermark(first_list, since):
+            return
+        fresh: Set[str] = set()
+
+        async def fetch_page(page: int) -> Optional[List[Dict[str, Any]]]:
+            nonlocal use_cache
+            key = f"{pwd_id}/{pdir_fid}/{page}"
+            expected = manifest["pages"].get(str(page)) if use_cache else None
+            cached = LISTING_CACHE.get("detail", key) if expected else None
+            if cached is not None and cached.get("fingerprint") == expected:
+                # 调用方会在文件字典上写 save_name，缓存里保留原样
+                return [dict(item) for item in cached["list"]]
+            page_response = await self._detail_page(session, pwd_id, stoken, pdir_fid, page)
+            if not page_response or page_response.get("code") != 0:
+                return None
+            page_list = page_response["data"]["list"]
+            fingerprint = listing_fingerprint(page_list)
+            fresh.add(str(page))
+            if use_cache and expected is not None and expected != fingerprint:
+                # 第一页没变但这一页变了，说明分享中间有改动，清单里其余页都不再可信
+                logger.info(f"分享列表第 {page} 页有变化，其余页重新请求: {pwd_id}")
+                use_cache = False
+                manifest["pages"] = {p: fp for p, fp in manifest["pages"].items() if p in fresh}
+            manifest["pages"][str(page)] = fingerprint
+            LISTING_CACHE.set("detail", manifest_key, manifest)
+            LISTING_CACHE.set("detail", key, {"list": [dict(item) for item in page_list], "fingerprint": fingerprint})
+            return page_list
+
+        pages = stream_pages(fetch_page, range(2, math.ceil(total / DETAIL_PAGE_SIZE) + 1), PAGE_CONCURRENCY)
+        try:
+            async for page_list in pages:
+                yield page_list
+                # 增量模式读到水位所在页即停止，已提前发出的请求随之取消
+                if page_list is None or reached_watermark(page_list, since):
+                    return
+        finally:
+            await pages.aclose()
+
+    async def get_detail(self, session: aiohttp.ClientSession, pwd_id: str, stoken: str, pdir_fid: str, since: Optional[Tuple[int, str]] = None, passcode: str = "") -> Optional[List[Dict[str, Any]]]:
+        # 任一页失败都返回 None，以免调用方把不完整的列表当成全部内容
+        return await collect_pages(self.iter_detail(session, pwd_id, stoken, pdir_fid, since, passcode))
 
+    @singleflight
     async def get_fids(self, session: aiohttp.ClientSession, file_paths: Tuple[str, ...]) -> List[Dict[str, Any]]:
         # 使用实例级别的缓存，避免协程重用问题
         cache_key = tuple(file_paths)
-        if not hasattr(self, '_fids_cache'):
-            self._fids_cache = {}
-        
         if cache_key in self._fids_cache:
             return self._fids_cache[cache_key]
         
-        fids = []
-        while file_paths:
-            batch = file_paths[:50]
-            file_paths = file_paths[50:]
-            url = "https://drive-pc.quark.cn/1/clouddrive/file/info/path_list"
+        async def fetch_batch(batch: Tuple[str, ...]) -> Optional[List[Dict[str, Any]]]:
+            url = f"{QUARK_API_BASE}/1/clouddrive/file/info/path_list"
             querystring = {"pr": "ucpro", "fr": "pc"}
             payload = {"file_path": batch, "namespace": "0"}
             headers = self.common_headers()
-            response = await fetch(session, "POST", url, json=payload, headers=headers, params=querystring)
+            response = await fetch(session, "POST", url, endpoint="path_list", json=payload, headers=headers, params=querystring)
             if response and response["code"] == 0:
-                fids += response["data"]
-            else:
-                logger.error(f"获取目录ID失败: {response['message'] if response else '无响应'}")
-                break
-        
-        # 缓存结果
-        self._fids_cache[cache_key] = fids
+                return response["data"]
+            logger.error(f"获取目录ID失败: {response['message'] if response else '无响应'}")
+            return None
+
+        # 路径多时分批并发查询，失败的批次跳过，返回其余批次的结果
+        batches = [file_paths[i:i + PATH_LIST_BATCH] for i in range(0, len(file_paths), PATH_LIST_BATCH)]
+        results = await gather_bounded(fetch_batch, batches, PAGE_CONCURRENCY)
+        fids = [item for result in results if result for item in result]
+        # 只缓存完整结果，部分失败时下次重新查询
+        if all(result is not None for result in results):
+            self._fids_cache[cache_key] = fids
         return fids
 
-    async def ls_dir(self, session: aiohttp.ClientSession, pdir_fid: str) -> List[Dict[str, Any]]:
-        file_list = []
-        page = 1
+    def invalidate_fids(self, paths: Iterable[str]) -> None:
+        """丢弃 get_fids 里涉及这些路径（及其子路径）的缓存结果"""
+        prefixes = [path.rstrip("/") + "/" for path in paths]
+        for key in [key for key in self._fids_cache if any((p + "/").startswith(prefix) for p in key for prefix in prefixes)]:
+            del self._fids_cache[key]
+
+    async def _ls_page(self, session: aiohttp.ClientSession, pdir_fid: str, page: int, size: int) -> Optional[Dict[str, Any]]:
+        url = f"{QUARK_API_BASE}/1/clouddrive/file/sort"
+        querystring = {
+            "pr": "ucpro",
+            "fr": "pc",
+            "uc_param_str": "",
+            "pdir_fid": pdir_fid,
+            "_page": page,
+            "_size": str(size),
+            "_fetch_total": "1",
+            "_fetch_sub_dirs": "0",
+            "_sort": "file_type:asc,updated_at:desc",
+        }
+        headers = self.common_headers()
+        return await fetch(session, "GET", url, endpoint="sort", headers=headers, params=querystring)
+
+    async def _ls_first_page(self, session: aiohttp.ClientSession, pdir_fid: str) -> Tuple[Optional[Dict[str, Any]], int]:
+        """取目录列表第一页，返回 (响应, 所用页大小)；页大小还没协商好时在锁内串行协商，免得并发任务各被拒绝一轮"""
+        if not self.ls_page_size_settled:
+            if self._ls_negotiation is None:
+                self._ls_negotiation = asyncio.Lock()
+            async with self._ls_negotiation:
+                if not self.ls_page_size_settled:
+                    return await self._negotiate_ls_page(session, pdir_fid)
+        # 页大小已确定，失败（如索引里的目录已被删除）与页大小无关，只请求一次
+        size = self.ls_page_size
+        response = await self._ls_page(session, pdir_fid, 1, size)
+        if not response or response.get("code") != 0:
+            logger.error(f"获取目录列表失败: {response.get('message') if response else '无响应'}")
+            return None, size
+        return response, size
+
+    async def _negotiate_ls_page(self, session: aiohttp.ClientSession, pdir_fid: str) -> Tuple[Optional[Dict[str, Any]], int]:
+        # 第一页从当前页大小起逐级尝试，只有接口拒绝请求参数时才缩小；成功后记在实例上供后续调用复用
+        size = self.ls_page_size
         while True:
-            url = "https://drive-pc.quark.cn/1/clouddrive/file/sort"
-            querystring = {
-                "pr": "ucpro",
-                "fr": "pc",
-                "uc_param_str": "",
-                "pdir_fid": pdir_fid,
-                "_page": page,
-                "_size": "50",
-                "_fetch_total": "1",
-                "_fetch_sub_dirs": "0",
-                "_sort": "file_type:asc,updated_at:desc",
-            }
-            headers = self.common_headers()
-            response = await fetch(session, "GET", url, headers=headers, params=querystring)
-            if response and response["data"]["list"]:
-                file_list += response["data"]["list"]
-                page += 1
-            else:
-                break
-            if len(file_list) >= response["metadata"]["_total"]:
-                break
-        return file_list
+            response = await self._ls_page(session, pdir_fid, 1, size)
+            if response and response.get("code") == 0:
+                self.ls_page_size_settled = True
+                return response, size
+            smaller = [s for s in LS_PAGE_SIZES if s < size]
+            if not smaller or not self.is_page_size_error(response):
+                # 目录不存在、网络异常、限流等与页大小无关，页大小留到下次再协商
+                logger.error(f"获取目录列表失败: {response.get('message') if response else '无响应'}")
+                return None, size
+            logger.info(f"目录列表接口不接受 _size={size}，改用 {smaller[0]}")
+            # 已确认太大的页大小不再尝试；协商在锁内进行，其他任务此时都在等锁
+            size = self.ls_page_size = smaller[0]
+
+    @staticmethod
+    def is_page_size_error(response: Optional[Dict[str, Any]]) -> bool:
+        """接口拒绝请求参数（HTTP 400，或提示 size、参数有误）才可能是页大小太大"""
+        if not response or RETRY_POLICY.is_transient(response):
+            return False
+        message = str(response.get("message", "")).lower()
+        return response.get("status") == 400 or "size" in message or "参数" in message
 
-    async def save_file(self, session: aiohttp.ClientSession, fid_list: List[str], fid_token_list: List[str], to_pdir_fid: str, pwd_id: str, stoken: str) -> Optional[Dict[str, Any]]:
-        url = "https://drive-pc.quark.cn/1/clouddrive/share/sharepage/save"
+    async def iter_ls_dir(self, session: aiohttp.ClientSession, pdir_fid: str) -> AsyncIterator[Optional[List[Dict[str, Any]]]]:
+        """按页码顺序逐页产出目录列表，后续页边处理边获取；某页失败时产出 None 并结束"""
+        response, size = await self._ls_first_page(session, pdir_fid)
+        if response is None:
+            yield None
+            return
+        first_list = response["data"]["list"]
+        total = response["metadata"]["_total"]
+        # 接口也可能不报错而是静默截断，按实际返回条数确定后续页大小
+        if 0 < len(first_list) < min(size, total):
+            size = len(first_list)
+            self.ls_page_size = size
+        yield first_list
+        if not first_list:
+            return
+
+        async def fetch_page(page: int) -> Optional[List[Dict[str, Any]]]:
+            page_response = await self._ls_page(session, pdir_fid, page, size)
+            if not page_response or page_response.get("code") != 0:
+                logger.error(f"获取目录列表失败: {page_response.get('message') if page_response else '无响应'}")
+                return None
+            return page_response["data"]["list"]
+
+        pages = stream_pages(fetch_page, range(2, math.ceil(total / size) + 1), PAGE_CONCURRENCY)
+        try:
+            async for page_list in pages:
+                yield page_list
+                if page_list is None:
+                    return
+        finally:
+            await pages.aclose()
+
+    @singleflight
+    async def ls_dir(self, session: aiohttp.ClientSession, pdir_fid: str) -> Optional[List[Dict[str, Any]]]:
+        return await collect_pages(self.iter_ls_dir(session, pdir_fid))
+
+    async def save_file(self, session: aiohttp.ClientSession, fid_list: List[str], fid_token_list: List[str], to_pdir_fid: str, pwd_id: str, stoken: str, deadline: Optional[float] = None, passcode: str = "") -> Optional[Dict[str, Any]]:
+        url = f"{QUARK_API_BASE}/1/clouddrive/share/sharepage/save"
         querystring = {
             "pr": "ucpro",
             "fr": "pc",
@@ -484,11 +2071,20 @@ class Quark:
             "scene": "link",
         }
         headers = self.common_headers()
-        response = await fetch(session, "POST", url, json=payload, headers=headers, params=querystring)
+        payload["stoken"] = STOKEN_STORE.get(pwd_id, passcode) or stoken
+        response = await fetch(session, "POST", url, endpoint="save", deadline=deadline, json=payload, headers=headers, params=querystring)
+        if STOKEN_STORE.is_token_error(response):
+            # 文件的 share_fid_token 可能来自缓存的分享列表，已随旧 stoken 失效，下次重新读取
+            LISTING_CACHE.invalidate("detail", f"{pwd_id}/")
+            # 被拒绝的转存请求没有生效，换新 stoken 重发一次是安全的
+            is_sharing, new_stoken = await self.refresh_stoken(session, pwd_id, passcode)
+            if is_sharing:
+                payload["stoken"] = new_stoken
+                response = await fetch(session, "POST", url, endpoint="save", deadline=deadline, json=payload, headers=headers, params=querystring)
         return response
 
     async def mkdir(self, session: aiohttp.ClientSession, dir_path: str) -> Optional[Dict[str, Any]]:
-        url = "https://drive-pc.quark.cn/1/clouddrive/file"
+        url = f"{QUARK_API_BASE}/1/clouddrive/file"
         querystring = {"pr": "ucpro", "fr": "pc", "uc_param_str": ""}
         payload = {
             "pdir_fid": "0",
@@ -497,27 +2093,31 @@ class Quark:
             "dir_init_lock": False,
         }
         headers = self.common_headers()
-        response = await fetch(session, "POST", url, json=payload, headers=headers, params=querystring)
+        response = await fetch(session, "POST", url, endpoint="mkdir", json=payload, headers=headers, params=querystring)
         return response
 
-    async def rename(self, session: aiohttp.ClientSession, fid: str, file_name: str) -> Optional[Dict[str, Any]]:
-        url = "https://drive-pc.quark.cn/1/clouddrive/file/rename"
+    async def rename(self, session: aiohttp.ClientSession, fid: str, file_name: str, is_dir: bool = True) -> Optional[Dict[str, Any]]:
+        url = f"{QUARK_API_BASE}/1/clouddrive/file/rename"
         querystring = {"pr": "ucpro", "fr": "pc", "uc_param_str": ""}
         payload = {"fid": fid, "file_name": file_name}
         headers = self.common_headers()
-        response = await fetch(session, "POST", url, json=payload, headers=headers, params=querystring)
+        response = await fetch(session, "POST", url, endpoint="rename", json=payload, headers=headers, params=querystring)
+        # 路径索引里只有目录，重命名文件不影响；调用方不确定时按目录处理
+        if is_dir:
+            self.forget_fids([fid])
         return response
 
     async def delete(self, session: aiohttp.ClientSession, filelist: List[str]) -> Optional[Dict[str, Any]]:
-        url = "https://drive-pc.quark.cn/1/clouddrive/file/delete"
+        url = f"{QUARK_API_BASE}/1/clouddrive/file/delete"
         querystring = {"pr": "ucpro", "fr": "pc", "uc_param_str": ""}
         payload = {"action_type": 2, "filelist": filelist, "exclude_fids": []}
         headers = self.common_headers()
-        response = await fetch(session, "POST", url, json=payload, headers=headers, params=querystring)
+        response = await fetch(session, "POST", url, endpoint="delete", json=payload, headers=headers, params=querystring)
+        self.forget_fids(filelist)
         return response
 
     async def recycle_list(self, session: aiohttp.ClientSession, page: int = 1, size: int = 30) -> List[Dict[str, Any]]:
-        url = "https://drive-pc.quark.cn/1/clouddrive/file/recycle/list"
+        url = f"{QUARK_API_BASE}/1/clouddrive/file/recycle/list"
         querystring = {
             "_page": page,
             "_size": size,
@@ -526,54 +2126,159 @@ class Quark:
             "uc_param_str": "",
         }
         headers = self.common_headers()
-        response = await fetch(session, "GET", url, headers=headers, params=querystring)
-        if response:
+        response = await fetch(session, "GET", url, endpoint="recycle", headers=headers, params=querystring)
+        if response and response.get("code") == 0:
             return response["data"]["list"]
         else:
             return []
 
     async def recycle_remove(self, session: aiohttp.ClientSession, record_list: List[str]) -> Optional[Dict[str, Any]]:
-        url = "https://drive-pc.quark.cn/1/clouddrive/file/recycle/remove"
+        url = f"{QUARK_API_BASE}/1/clouddrive/file/recycle/remove"
         querystring = {"uc_param_str": "", "fr": "pc", "pr": "ucpro"}
         payload = {
             "select_mode": 2,
             "record_list": record_list,
         }
         headers = self.common_headers()
-        response = await fetch(session, "POST", url, json=payload, headers=headers, params=querystring)
+        response = await fetch(session, "POST", url, endpoint="recycle", json=payload, headers=headers, params=querystring)
         return response
 
-    async def update_savepath_fid(self, session: aiohttp.ClientSession, tasklist: List[Dict[str, Any]]) -> bool:
-        dir_paths = [
-            re.sub(r"/{2,}", "/", f"/{item['savepath']}")
-            for item in tasklist
-            if not item.get("enddate")
-            or (
-                datetime.now().date()
-                <= datetime.strptime(item["enddate"], "%Y-%m-%d").date()
+    def remember_savepath(self, savepath: str, fid: str) -> None:
+        self.savepath_fid[savepath] = fid
+        parent = posixpath.dirname(savepath)
+        PATH_INDEX.set(self.uid, savepath, fid, self.savepath_fid.get(parent) or PATH_INDEX.get(self.uid, parent) or "")
+
+    def forget_fids(self, fids: List[str]) -> None:
+        # 重命名或删除后，涉及的目录及其子目录都不能再用旧路径定位
+        PATH_INDEX.invalidate_fids(self.uid, fids)
+        for path in [path for path, fid in self.savepath_fid.items() if fid in fids and path != "/"]:
+            for key in [key for key in self.savepath_fid if key == path or key.startswith(path + "/")]:
+                self.savepath_fid.pop(key, None)
+                self.unverified_paths.discard(key)
+
+    async def resolve_savepath(self, session: aiohttp.ClientSession, savepath: str, create: bool = True) -> Optional[str]:
+        """保存路径 → fid：依次查本次运行已解析的、持久化索引、path_list，不存在时按需创建"""
+        if self.savepath_fid.get(savepath):
+            return self.savepath_fid[savepath]
+        fid = PATH_INDEX.get(self.uid, savepath)
+        if fid:
+            self.savepath_fid[savepath] = fid
+            self.unverified_paths.add(savepath)
+            return fid
+        if create:
+            return (await self.make_dirs(session, [savepath])).get(savepath)
+        get_fids = await self.get_fids(session, (savepath,))
+        if not get_fids:
+            return None
+        fid = get_fids[0]["fid"]
+        self.remember_savepath(savepath, fid)
+        return fid
+
+    async def revalidate_savepath(self, session: aiohttp.ClientSession, savepath: str, create: bool = True) -> Optional[str]:
+        """索引中的 fid 用不了（目录被删除或移动）时，丢弃该路径后重新解析；本次运行已校验过的路径不再重复"""
+        if savepath not in self.unverified_paths:
+            return None
+        logger.info(f"目录 {savepath} 的缓存 fid 已失效，重新解析")
+        self.unverified_paths.discard(savepath)
+        PATH_INDEX.invalidate(self.uid, savepath)
+        self.savepath_fid.pop(savepath, None)
+        self.invalidate_fids([savepath])
+        return await self.resolve_savepath(session, savepath, create)
+
+    async def list_savepath(self, session: aiohttp.ClientSession, savepath: str) -> Tuple[Optional[str], Optional[List[Dict[str, Any]]]]:
+        """解析保存目录并读取完整列表，返回 (fid, 列表)；索引里的 fid 读不出列表时重新解析一次"""
+        to_pdir_fid = await self.resolve_savepath(session, savepath)
+        if not to_pdir_fid:
+            return None, None
+        dir_file_list = await self.ls_dir(session, to_pdir_fid)
+        if dir_file_list is None:
+            new_fid = await self.revalidate_savepath(session, savepath)
+            if new_fid:
+                to_pdir_fid = new_fid
+                dir_file_list = await self.ls_dir(session, to_pdir_fid)
+        if dir_file_list:
+            self.unverified_paths.discard(savepath)
+        return to_pdir_fid, dir_file_list
+
+    async def make_dirs(self, session: aiohttp.ClientSession, dir_paths: List[str]) -> Dict[str, str]:
+        """批量 mkdir -p，返回 {路径: fid}，创建失败的路径不在结果中
+
+        所有路径看作一棵前缀树：先用 path_list 批量查出已存在的，缺失的再按层级由浅到深、
+        同层有限并发地创建。按完整路径 mkdir 会顺带建出中间目录，因此只显式创建目标路径
+        和有多个缺失子目录的分叉点；分叉点总在更浅的层级先建好，同层并发创建的目录不会争抢同一个父目录。
+        """
+        targets = sorted(set(dir_paths) - {"/"})
+        resolved = {"/": "0"}
+        if targets:
+            for item in await self.get_fids(session, tuple(targets)):
+                resolved[item["file_path"]] = item["fid"]
+        missing = [path for path in targets if path not in resolved]
+
+        # 缺失目标向上直到已知目录为止的前缀树，记录每个节点的缺失子目录
+        children: Dict[str, Set[str]] = {}
+        for path in missing:
+            node = path
+            while node not in resolved and node not in self.savepath_fid:
+                parent = posixpath.dirname(node)
+                siblings = children.setdefault(parent, set())
+                if node in siblings:
+                    break
+                siblings.add(node)
+                node = parent
+        # 只有分叉点是否存在会影响创建顺序，单链上的中间目录交给 mkdir 顺带创建
+        forks = sorted(
+            path for path, subs in children.items()
+            if len(subs) > 1 and path not in resolved and path not in self.savepath_fid and path not in missing
+        )
+        if forks:
+            for item in await self.get_fids(session, tuple(forks)):
+                resolved[item["file_path"]] = item["fid"]
+
+        to_create = set(missing) | {path for path in forks if path not in resolved}
+        failed: Set[str] = set()
+        for depth in sorted({path.count("/") for path in to_create}):
+            level = sorted(
+                path for path in to_create
+                if path.count("/") == depth and not any(path.startswith(f"{f}/") for f in failed)
             )
-        ]
+            results = await gather_bounded(lambda path: self.mkdir(session, path), level, MKDIR_CONCURRENCY)
+            errors = {}
+            for path, mkdir_return in zip(level, results):
+                if mkdir_return and mkdir_return.get("code") == 0:
+                    resolved[path] = mkdir_return["data"]["fid"]
+                    logger.info(f"创建文件夹：{path}")
+                else:
+                    errors[path] = mkdir_return["message"] if mkdir_return else "无响应"
+            if errors:
+                # 同名冲突通常是目录已被别处建好，再查一次确认
+                self.invalidate_fids(errors)
+                for item in await self.get_fids(session, tuple(errors)):
+                    resolved[item["file_path"]] = item["fid"]
+                for path, message in errors.items():
+                    if path not in resolved:
+                        logger.error(f"创建文件夹：{path} 失败, {message}")
+                        failed.add(path)
+
+        # 由浅到深记录，写索引时父目录的 fid 已知
+        for path in sorted(targets, key=lambda p: p.count("/")):
+            if path in resolved:
+                self.remember_savepath(path, resolved[path])
+        return {path: resolved[path] for path in targets if path in resolved}
+
+    async def update_savepath_fid(self, session: aiohttp.ClientSession, tasklist: List[Dict[str, Any]]) -> bool:
+        today = datetime.now().date()
+        dir_paths = [plan.savepath for plan in map(TASK_PLANS.get, tasklist) if plan.active(today)]
         if not dir_paths:
             return False
-        dir_paths_exist_arr = await self.get_fids(session, tuple(dir_paths))
-        dir_paths_exist = [item["file_path"] for item in dir_paths_exist_arr]
-        dir_paths_unexist = list(set(dir_paths) - set(dir_paths_exist) - set(["/"]))
-        tasks = []
-        for dir_path in dir_paths_unexist:
-            tasks.append(self.mkdir(session, dir_path))
-        mkdir_results = await asyncio.gather(*tasks)
-        for dir_path, mkdir_return in zip(dir_paths_unexist, mkdir_results):
-            if mkdir_return and mkdir_return.get("code") == 0:
-                new_dir = mkdir_return["data"]
-                dir_paths_exist_arr.append(
-                    {"file_path": dir_path, "fid": new_dir["fid"]}
-                )
-                logger.info(f"创建文件夹：{dir_path}")
-            else:
-                logger.error(f"创建文件夹：{dir_path} 失败, {mkdir_return['message'] if mkdir_return else '无响应'}")
-        # 储存目标目录的fid
-        for dir_path in dir_paths_exist_arr:
-            self.savepath_fid[dir_path["file_path"]] = dir_path["fid"]
+        # 索引里已有的路径直接使用，只解析剩下的
+        for dir_path in dir_paths:
+            if not self.savepath_fid.get(dir_path) and (fid := PATH_INDEX.get(self.uid, dir_path)):
+                self.savepath_fid[dir_path] = fid
+                self.unverified_paths.add(dir_path)
+        dir_paths = [dir_path for dir_path in dir_paths if not self.savepath_fid.get(dir_path)]
+        if not dir_paths:
+            return True
+        await self.make_dirs(session, dir_paths)
         return True
 
     async def do_save_check(self, session: aiohttp.ClientSession, shareurl: str, savepath: str) -> Union[Dict[str, Any], bool]:
@@ -587,6 +2292,8 @@ class Quark:
                 add_notify(f"❌：{stoken}\n")
                 return False
             share_file_list = await self.get_detail(session, pwd_id, stoken, pdir_fid)
+            if not share_file_list:
+                return False
             fid_list = [item["fid"] for item in share_file_list]
             fid_token_list = [item["share_fid_token"] for item in share_file_list]
             file_name_list = [item["file_name"] for item in share_file_list]
@@ -611,13 +2318,18 @@ class Quark:
             if save_file_return["code"] == 41017:
                 return False
             elif save_file_return["code"] == 0:
-                dir_file_list = await self.ls_dir(session, to_pdir_fid)
-                del_list = [
-                    item["fid"]
-                    for item in dir_file_list
-                    if (item["file_name"] in file_name_list)
-                    and ((datetime.now().timestamp() - item["created_at"]) < 60)
-                ]
+                del_list = []
+                pages = self.iter_ls_dir(session, to_pdir_fid)
+                try:
+                    async for page_list in pages:
+                        del_list += [
+                            item["fid"]
+                            for item in page_list or []
+                            if (item["file_name"] in file_name_list)
+                            and ((datetime.now().timestamp() - item["created_at"]) < 60)
+                        ]
+                finally:
+                    await pages.aclose()
                 if del_list:
                     await self.delete(session, del_list)
                     recycle_list = await self.recycle_list(session)
@@ -635,7 +2347,7 @@ class Quark:
                 logger.error(f"转存测试失败: {str(e)}")
             return False
 
-    async def do_save_task(self, session: aiohttp.ClientSession, task: Dict[str, Any]) -> Optional[bool]:
+    async def do_save_task(self, session: aiohttp.ClientSession, task: Dict[str, Any], deadline: Optional[float] = None) -> Optional[bool]:
         if task.get("shareurl_ban"):
             logger.info(f"《{task['taskname']}》：{task['shareurl_ban']}")
             return None
@@ -649,7 +2361,7 @@ class Quark:
             add_notify(f"❌《{task['taskname']}》：{stoken}\n")
             task["shareurl_ban"] = stoken
             return
-        updated_tree = await self.dir_check_and_save(session, task, pwd_id, stoken, pdir_fid)
+        updated_tree = await self.dir_check_and_save(session, task, pwd_id, stoken, pdir_fid, deadline=deadline)
         if updated_tree.size(1) > 0:
             add_notify(f"✅《{task['taskname']}》添加追更：\n{updated_tree}")
             return True
@@ -657,188 +2369,326 @@ class Quark:
             logger.info(f"任务结束：没有新的转存任务")
             return False
 
-    async def dir_check_and_save(self, session: aiohttp.ClientSession, task: Dict[str, Any], pwd_id: str, stoken: str, pdir_fid: str = "", subdir_path: str = "") -> Tree:
+    async def dir_check_and_save(self, session: aiohttp.ClientSession, task: Dict[str, Any], pwd_id: str, stoken: str, pdir_fid: str = "", subdir_path: str = "", deadline: Optional[float] = None, walk: Optional[SubdirWalk] = None) -> Tree:
+        check_deadline(deadline, f"读取分享目录 {subdir_path or '/'}")
+        if walk is None:
+            walk = SubdirWalk(pdir_fid)
         tree = Tree()
         tree.create_node(task["savepath"], pdir_fid)
-        share_file_list = await self.get_detail(session, pwd_id, stoken, pdir_fid)
+        plan = TASK_PLANS.get(task)
+        savepath = plan.path(subdir_path)
+        # 目标目录列表和分享列表同时读取，分享列表到一页就匹配一页
+        target = asyncio.ensure_future(self.list_savepath(session, savepath))
+        # 只对任务顶层目录使用水位，子目录每次完整读取
+        listed_fid = pdir_fid
+        mark = WATERMARKS.get(self.uid, task, pwd_id, pdir_fid) if subdir_path == "" else None
+        pages = self.iter_detail(session, pwd_id, stoken, pdir_fid, WatermarkStore.since(mark))
+        pipeline = None
+        read_failed = False
+        # 匹配到的子目录边读边开始遍历，按分享里的顺序记下，最后依次合并进目录树
+        subdirs: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        try:
+            share_page = await pages.__anext__()
+            if share_page is None:
+                walk.failed = True
+                add_notify(f"❌《{task['taskname']}》读取分享内容失败，本次跳过\n")
+                return tree
+            elif not share_page:
+                if subdir_path == "":
+                    task["shareurl_ban"] = "分享为空，文件已被分享者删除"
+                    add_notify(f"《{task['taskname']}》：{task['shareurl_ban']}")
+                return tree
+            elif (
+                len(share_page) == 1
+                and share_page[0]["dir"]
+                and subdir_path == ""
+            ):
+                # 第一页不满一页，说明整个分享就这一个文件夹
+                logger.info("🧠 该分享是一个文件夹，读取文件夹内列表")
+                await pages.aclose()
+                listed_fid = share_page[0]["fid"]
+                walk.visit(listed_fid)
+                mark = WATERMARKS.get(self.uid, task, pwd_id, listed_fid)
+                pages = self.iter_detail(session, pwd_id, stoken, listed_fid, WatermarkStore.since(mark))
+                share_page = await pages.__anext__()
+                if share_page is None:
+                    walk.failed = True
+                    add_notify(f"❌《{task['taskname']}》读取分享内容失败，本次跳过\n")
+                    return tree
 
-        if not share_file_list:
-            if subdir_path == "":
-                task["shareurl_ban"] = "分享为空，文件已被分享者删除"
-                add_notify(f"《{task['taskname']}》：{task['shareurl_ban']}")
-            return tree
-        elif (
-            len(share_file_list) == 1
-            and share_file_list[0]["dir"]
-            and subdir_path == ""
-        ):
-            logger.info("🧠 该分享是一个文件夹，读取文件夹内列表")
-            share_file_list = await self.get_detail(session, pwd_id, stoken, share_file_list[0]["fid"])
-
-        savepath = re.sub(r"/{2,}", "/", f"/{task['savepath']}{subdir_path}")
-        if not self.savepath_fid.get(savepath):
-            get_fids = await self.get_fids(session, (savepath,))
-            if get_fids:
-                self.savepath_fid[savepath] = get_fids[0]["fid"]
-            else:
-                # 尝试创建目录，就像do_save_check方法中那样
-                logger.info(f"目录 {savepath} 不存在，尝试创建...")
-                mkdir_result = await self.mkdir(session, savepath)
-                if mkdir_result and mkdir_result.get("code") == 0:
-                    self.savepath_fid[savepath] = mkdir_result["data"]["fid"]
-                    logger.info(f"✅ 成功创建目录 {savepath}，fid: {mkdir_result['data']['fid']}")
-                else:
-                    logger.error(f"❌ 目录 {savepath} 创建失败，跳过转存")
+            to_pdir_fid, dir_file_list = await target
+            if not to_pdir_fid:
+                walk.failed = True
+                logger.error(f"❌ 目录 {savepath} 创建失败，跳过转存")
+                return tree
+            if dir_file_list is None:
+                # 目标目录列表不完整时无法判断哪些文件已存在，跳过以免重复转存
+                walk.failed = True
+                add_notify(f"❌《{task['taskname']}》读取目录 {savepath} 失败，本次跳过\n")
+                return tree
+            if WATERMARKS.changed(mark, len(dir_file_list)):
+                # 目标目录有增删（比如转存过的文件被删了），水位之前的缺口只有完整读取才能补上
+                logger.info("🧠 目标目录有变化，本次完整读取分享列表")
+                mark = None
+                await pages.aclose()
+                pages = self.iter_detail(session, pwd_id, stoken, listed_fid)
+                share_page = await pages.__anext__()
+                if share_page is None:
+                    walk.failed = True
+                    add_notify(f"❌《{task['taskname']}》读取分享内容失败，本次跳过\n")
                     return tree
-        to_pdir_fid = self.savepath_fid[savepath]
-        dir_file_list = await self.ls_dir(session, to_pdir_fid)
 
-        need_save_list = []
-        for share_file in share_file_list:
-            if share_file["dir"] and task.get("update_subdir", False):
-                pattern, replace = task["update_subdir"], ""
-            else:
-                # 如果没有pattern和replace字段，则匹配所有文件
-                if 'pattern' not in task:
-                    pattern, replace = ".*", ""
-                else:
-                    pattern, replace = magic_regex_func(task["pattern"], task["replace"])
-            if re.search(pattern, share_file["file_name"]):
-                save_name = (
-                    re.sub(pattern, replace, share_file["file_name"])
-                    if replace != ""
-                    else share_file["file_name"]
-                )
-            if task.get("ignore_extension") and not share_file["dir"]:
-                def compare_func(a: str, b1: str, b2: str) -> bool:
-                    return (os.path.splitext(a)[0] == os.path.splitext(b1)[0]
-                            or os.path.splitext(a)[0] == os.path.splitext(b2)[0])
-            else:
-                def compare_func(a: str, b1: str, b2: str) -> bool:
-                    return a == b1 or a == b2
-                file_exists = any(
-                    compare_func(
-                        dir_file["file_name"], share_file["file_name"], save_name
-                    )
-                    for dir_file in dir_file_list
+            existing = NameIndex(dir_file_list)
+            # 匹配到的新文件凑满一块就开始转存，不等后面的页
+            pipeline = SavePipeline(self, session, pwd_id, stoken, savepath, to_pdir_fid, deadline)
+            # 推进水位只需要最新的文件，匹配过的分享页不再保留
+            watermark_files = []
+            while True:
+                reached_start = False
+                for share_file in share_page:
+                    save_name = plan.save_name(share_file["file_name"], share_file["dir"])
+                    if save_name is not None:
+                        ignore_extension = plan.ignore_extension and not share_file["dir"]
+                        if not existing.exists(share_file["file_name"], save_name, ignore_extension):
+                            share_file["save_name"] = save_name
+                            pipeline.add(share_file)
+                        elif share_file["dir"]:
+                            if task.get("update_subdir", False):
+                                if subdir_path.count("/") >= SUBDIR_MAX_DEPTH:
+                                    logger.warning(f"子文件夹超过 {SUBDIR_MAX_DEPTH} 层，不再深入：{savepath}/{share_file['file_name']}")
+                                elif not walk.visit(share_file["fid"]):
+                                    logger.warning(f"子文件夹已检查过，跳过：{savepath}/{share_file['file_name']}")
+                                else:
+                                    logger.info(f"检查子文件夹：{savepath}/{share_file['file_name']}")
+                                    # 子目录就在刚读到的目标目录列表里，直接记下 fid，免去一次 path_list
+                                    subdir_savepath = re.sub(r"/{2,}", "/", f"{savepath}/{share_file['file_name']}")
+                                    subdir_fid = existing.dirs.get(share_file["file_name"])
+                                    if subdir_fid:
+                                        self.remember_savepath(subdir_savepath, subdir_fid)
+                                        self.unverified_paths.discard(subdir_savepath)
+                                    subdirs.append((share_file, walk.spawn(self.dir_check_and_save(
+                                        session,
+                                        task,
+                                        pwd_id,
+                                        stoken,
+                                        share_file["fid"],
+                                        f"{subdir_path}/{share_file['file_name']}",
+                                        deadline=deadline,
+                                        walk=walk,
+                                    ))))
+                    if share_file["fid"] == task.get("startfid", ""):
+                        reached_start = True
+                        break
+                files = [item for item in share_page if not item["dir"]]
+                if files:
+                    watermark_files = [max(watermark_files + files, key=lambda item: item["updated_at"])]
+                if reached_start:
+                    break
+                # 匹配本页期间后续页已在获取，这里通常不用再等
+                try:
+                    share_page = await pages.__anext__()
+                except StopAsyncIteration:
+                    break
+                if share_page is None:
+                    # 已提交的块仍要等结果，便于通知里如实列出
+                    read_failed = True
+                    break
+        except BaseException:
+            if pipeline:
+                pipeline.cancel()
+            for _, future in subdirs:
+                future.cancel()
+            raise
+        finally:
+            if not target.done():
+                target.cancel()
+            await pages.aclose()
+
+        try:
+            saved_list, err_msg = await pipeline.finish()
+            subdir_trees = await walk.join([future for _, future in subdirs])
+        finally:
+            for _, future in subdirs:
+                future.cancel()
+        for (share_file, _), subdir_tree in zip(subdirs, subdir_trees):
+            if subdir_tree.size(1) > 0:
+                tree.create_node(
+                    "📁" + share_file["file_name"],
+                    share_file["fid"],
+                    parent=pdir_fid,
                 )
-                if not file_exists:
-                    share_file["save_name"] = save_name
-                    need_save_list.append(share_file)
-                elif share_file["dir"]:
-                    if task.get("update_subdir", False):
-                        logger.info(f"检查子文件夹：{savepath}/{share_file['file_name']}")
-                        subdir_tree = await self.dir_check_and_save(
-                            session,
-                            task,
-                            pwd_id,
-                            stoken,
-                            share_file["fid"],
-                            f"{subdir_path}/{share_file['file_name']}",
-                        )
-                        if subdir_tree.size(1) > 0:
-                            tree.create_node(
-                                "📁" + share_file["file_name"],
-                                share_file["fid"],
-                                parent=pdir_fid,
-                            )
-                            tree.merge(share_file["fid"], subdir_tree, deep=False)
-            if share_file["fid"] == task.get("startfid", ""):
-                break
+                tree.merge(share_file["fid"], subdir_tree, deep=False)
+        for item in saved_list:
+            icon = (
+                "📁"
+                if item["dir"]
+                else "🎞️" if item["obj_category"] == "video" else ""
+            )
+            tree.create_node(
+                f"{icon}{item['save_name']}", item["fid"], parent=pdir_fid
+            )
+        if read_failed:
+            walk.failed = True
+            add_notify(f"❌《{task['taskname']}》读取分享内容失败，本次跳过\n")
+            return tree
+        if err_msg:
+            walk.failed = True
+            add_notify(f"❌《{task['taskname']}》转存失败：{err_msg}\n")
+            return tree
+        if subdir_path == "" and not walk.failed:
+            # 本次检查和转存（包括各层子目录）都成功才推进水位，失败时下次仍从旧水位开始读
+            WATERMARKS.set(self.uid, task, pwd_id, listed_fid, watermark_files, mark, len(dir_file_list) + len(saved_list))
+        return tree
 
-        fid_list = [item["fid"] for item in need_save_list]
-        fid_token_list = [item["share_fid_token"] for item in need_save_list]
-        save_name_list = [item["save_name"] for item in need_save_list]
-        if fid_list:
-            save_file_return = await self.save_file(session, fid_list, fid_token_list, to_pdir_fid, pwd_id, stoken)
-            err_msg = None
-            if save_file_return and save_file_return.get("code") == 0:
-                task_id = save_file_return["data"]["task_id"]
-                query_task_return = await self.query_task(session, task_id)
-                if query_task_return and query_task_return.get("code") == 0:
-                    save_name_list.sort()
-                    for item in need_save_list:
-                        icon = (
-                            "📁"
-                            if item["dir"]
-                            else "🎞️" if item["obj_category"] == "video" else ""
-                        )
-                        tree.create_node(
-                            f"{icon}{item['save_name']}", item["fid"], parent=pdir_fid
-                        )
-                else:
-                    err_msg = query_task_return["message"] if query_task_return else "无响应"
-            else:
-                err_msg = save_file_return["message"] if save_file_return else "无响应"
+    async def _task_status(self, session: aiohttp.ClientSession, task_id: str, retry_index: int, deadline: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        url = f"{QUARK_API_BASE}/1/clouddrive/task"
+        querystring = {
+            "pr": "ucpro",
+            "fr": "pc",
+            "uc_param_str": "",
+            "task_id": task_id,
+            "retry_index": retry_index,
+            "__dt": int(random.uniform(1, 5) * 60 * 1000),
+            "__t": datetime.now().timestamp(),
+        }
+        headers = self.common_headers()
+        return await fetch(session, "GET", url, endpoint="task", deadline=deadline, headers=headers, params=querystring)
 
-            if err_msg:
-                add_notify(f"❌《{task['taskname']}》转存失败：{err_msg}\n")
-        return tree
+    async def query_tasks(self, session: aiohttp.ClientSession, task_ids: List[str], deadline: Optional[float] = None) -> Dict[str, Optional[Dict[str, Any]]]:
+        """等待多个转存任务的结果，返回 {task_id: 最终响应}；轮询统一交给 TASK_POLLER"""
+        futures = [TASK_POLLER.wait(self, session, task_id, deadline) for task_id in task_ids]
+        return dict(zip(task_ids, await asyncio.gather(*futures)))
 
-    async def query_task(self, session: aiohttp.ClientSession, task_id: str) -> Optional[Dict[str, Any]]:
-        retry_index = 0
-        while True:
-            url = "https://drive-pc.quark.cn/1/clouddrive/task"
-            querystring = {
-                "pr": "ucpro",
-                "fr": "pc",
-                "uc_param_str": "",
-                "task_id": task_id,
-                "retry_index": retry_index,
-                "__dt": int(random.uniform(1, 5) * 60 * 1000),
-                "__t": datetime.now().timestamp(),
-            }
-            headers = self.common_headers()
-            response = await fetch(session, "GET", url, headers=headers, params=querystring)
-            if response:
-                if response["data"]["status"] != 0:
-                    break
-                else:
-                    if retry_index == 0:
-                        logger.info(f"正在等待[{response['data']['task_title']}]执行结果")
-                    else:
-                        logger.info(".")
-                    retry_index += 1
-                    await asyncio.sleep(0.5)
-            else:
-                break
-        return response
+    async def query_task(self, session: aiohttp.ClientSession, task_id: str, deadline: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        return (await self.query_tasks(session, [task_id], deadline))[task_id]
 
     async def do_rename_task(self, session: aiohttp.ClientSession, task: Dict[str, Any], subdir_path: str = "") -> bool:
-        # 检查任务是否有pattern和replace字段
-        if "pattern" not in task or "replace" not in task:
-            # 如果没有pattern和replace字段，跳过重命名任务
+        # 没有pattern和replace字段（或展开后为空）时跳过重命名任务
+        plan = TASK_PLANS.get(task)
+        if not plan.renames:
             return False
-        pattern, replace = magic_regex_func(task["pattern"], task["replace"])
-        if not pattern or not replace:
+        savepath = plan.path(subdir_path)
+        pdir_fid = await self.resolve_savepath(session, savepath, create=False)
+        if not pdir_fid:
+            return False
+        dir_file_list = await self.ls_dir(session, pdir_fid)
+        if dir_file_list is None:
+            pdir_fid = await self.revalidate_savepath(session, savepath, create=False)
+            dir_file_list = await self.ls_dir(session, pdir_fid) if pdir_fid else None
+        if dir_file_list is None:
             return False
-        savepath = re.sub(r"/{2,}", "/", f"/{task['savepath']}{subdir_path}")
-        if not self.savepath_fid.get(savepath):
-            fids = await self.get_fids(session, (savepath,))
-            if fids:
-                self.savepath_fid[savepath] = fids[0]["fid"]
-            else:
-                return False
-        dir_file_list = await self.ls_dir(session, self.savepath_fid[savepath])
         dir_file_name_list = [item["file_name"] for item in dir_file_list]
         rename_tasks = []
         for dir_file in dir_file_list:
             if dir_file["dir"]:
                 rename_tasks.append(self.do_rename_task(session, task, f"{subdir_path}/{dir_file['file_name']}"))
-            if re.search(pattern, dir_file["file_name"]):
-                save_name = (
-                    re.sub(pattern, replace, dir_file["file_name"])
-                    if replace != ""
-                    else dir_file["file_name"]
-                )
+            save_name = plan.rename_to(dir_file["file_name"])
+            if save_name is not None:
                 if save_name != dir_file["file_name"] and (
                     save_name not in dir_file_name_list
                 ):
-                    rename_tasks.append(self.rename(session, dir_file["fid"], save_name))
+                    rename_tasks.append(self.rename(session, dir_file["fid"], save_name, dir_file["dir"]))
         rename_results = await asyncio.gather(*rename_tasks)
         is_rename = any(rename_results)
         return is_rename
 
+class SavePipeline:
+    """分块转存：匹配到的文件每满 SAVE_CHUNK_SIZE 个就提交一块，最多 SAVE_CONCURRENCY 块同时提交，
+    调用方继续匹配后面的文件；finish 时一起轮询所有转存任务，只重发被拒绝的块"""
+
+    def __init__(self, account: Quark, session: aiohttp.ClientSession, pwd_id: str, stoken: str, savepath: str, to_pdir_fid: str, deadline: Optional[float] = None):
+        self.account = account
+        self.session = session
+        self.pwd_id = pwd_id
+        self.stoken = stoken
+        self.savepath = savepath
+        self.to_pdir_fid = to_pdir_fid
+        self.deadline = deadline
+        self.items: List[Dict[str, Any]] = []
+        self.buffer: List[Dict[str, Any]] = []
+        self.submissions: List[Tuple[List[Dict[str, Any]], asyncio.Future]] = []
+        self.semaphore = asyncio.Semaphore(max(1, SAVE_CONCURRENCY))
+
+    def add(self, item: Dict[str, Any]) -> None:
+        self.items.append(item)
+        self.buffer.append(item)
+        if len(self.buffer) >= max(1, SAVE_CHUNK_SIZE):
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.buffer:
+            return
+        check_deadline(self.deadline, f"转存到 {self.savepath}")
+        chunk, self.buffer = self.buffer, []
+        self.submissions.append((chunk, asyncio.ensure_future(self._save(chunk))))
+
+    async def _save(self, chunk: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        async with self.semaphore:
+            fid_list = [item["fid"] for item in chunk]
+            fid_token_list = [item["share_fid_token"] for item in chunk]
+            return await self.account.save_file(self.session, fid_list, fid_token_list, self.to_pdir_fid, self.pwd_id, self.stoken, self.deadline)
+
+    async def finish(self) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """等待所有块完成，返回 (已转存的文件, 错误信息)，文件保持加入时的顺序"""
+        try:
+            return await self._finish()
+        except BaseException:
+            # 超时被取消时不再让剩下的块继续提交
+            self.cancel()
+            raise
+
+    async def _finish(self) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        self.flush()
+        saved_fids = set()
+        err_msg = None
+        for attempt in range(2):
+            submissions, self.submissions = self.submissions, []
+            responses = await asyncio.gather(*(future for _, future in submissions))
+            tasks, rejected = {}, []
+            for (chunk, _), response in zip(submissions, responses):
+                if response and response.get("code") == 0:
+                    tasks[response["data"]["task_id"]] = chunk
+                elif self.is_rejected(response):
+                    rejected.append((chunk, response))
+                else:
+                    # 不确定是否已提交，重发可能重复转存；报告错误，漏掉的文件下次运行按目标目录补上
+                    err_msg = response.get("message") if response else "无响应"
+            results = await self.account.query_tasks(self.session, list(tasks), self.deadline)
+            for task_id, chunk in tasks.items():
+                response = results.get(task_id)
+                if response and response.get("code") == 0:
+                    saved_fids.update(item["fid"] for item in chunk)
+                else:
+                    err_msg = response["message"] if response else "无响应"
+            if not rejected:
+                break
+            if attempt == 1:
+                err_msg = rejected[0][1].get("message") or err_msg
+                break
+            # 被拒绝的块没有生效，可以安全重发；空目录列表无法证明索引里的 fid 仍有效，非临时性错误先重新解析目录
+            if any(not RETRY_POLICY.is_transient(response) for _, response in rejected):
+                new_fid = await self.account.revalidate_savepath(self.session, self.savepath)
+                if new_fid:
+                    self.to_pdir_fid = new_fid
+            for chunk, _ in rejected:
+                self.submissions.append((chunk, asyncio.ensure_future(self._save(chunk))))
+        return [item for item in self.items if item["fid"] in saved_fids], err_msg
+
+    @staticmethod
+    def is_rejected(response: Optional[Dict[str, Any]]) -> bool:
+        """请求确定没有生效：根本没发出（熔断、截止时间已到），或服务端给了明确的业务错误；
+        网络异常、超时、无法解析的响应和 5xx 都可能已经转存成功"""
+        if not response:
+            return False
+        if response.get("unsent"):
+            return True
+        status = response.get("status")
+        return response.get("code") != -1 and not (isinstance(status, int) and status >= 500)
+
+    def cancel(self) -> None:
+        for _, future in self.submissions:
+            future.cancel()
+
 async def verify_account(session: aiohttp.ClientSession, account: Quark) -> bool:
     logger.info(f"▶️ 验证第{account.index}个账号")
     if "__uid" not in account.cookie:
@@ -913,27 +2763,50 @@ async def do_sign(session: aiohttp.ClientSession, account: Quark) -> None:
             else:
                 logger.error(f"📅 签到异常: {sign_return}")
 
-async def do_save(session: aiohttp.ClientSession, account: Quark, tasklist: List[Dict[str, Any]] = []) -> None:
+async def do_save(session: aiohttp.ClientSession, account: Quark, tasklist: List[Dict[str, Any]] = [], deadline: Optional[float] = None) -> None:
     emby = Emby(
         CONFIG_DATA.get("emby", {}).get("url", ""),
         CONFIG_DATA.get("emby", {}).get("apikey", ""),
     )
     logger.info(f"转存账号: {account.nickname}")
-    await account.update_savepath_fid(session, tasklist)
+    # 先把每个任务编译成执行计划，配置无效的任务单独报告并跳过，不影响其余任务
+    valid_tasks = []
+    for task in tasklist:
+        try:
+            TASK_PLANS.get(task)
+        except (re.error, ValueError, KeyError) as e:
+            logger.error(f"❌ 任务配置无效: {task.get('taskname')}: {e}")
+            add_notify(f"❌《{task.get('taskname')}》配置无效：{e}\n")
+        else:
+            valid_tasks.append(task)
+    await account.update_savepath_fid(session, valid_tasks)
+    valid_ids = {id(task) for task in valid_tasks}
+    today = datetime.now().date()
 
     def check_date(task):
-        return (
-            (not task.get("enddate") or datetime.now().date() <= datetime.strptime(task["enddate"], "%Y-%m-%d").date())
-            and (
-                not task.get("runweek")
-                or (datetime.today().weekday() + 1 in task.get("runweek"))
-            )
-        )
+        return id(task) in valid_ids and TASK_PLANS.get(task).due(today)
 
-    tasks = []
-    for index, task in enumerate(tasklist):
-        if check_date(task):
-            logger.info(f"#{index+1}------------------")
+    async def run_task(task, task_deadline):
+        is_new = await account.do_save_task(session, task, task_deadline)
+        is_rename = await account.do_rename_task(session, task)
+        return is_new, is_rename
+
+    semaphore = asyncio.Semaphore(max(1, TASK_CONCURRENCY))
+    savepath_locks = PathLocks()
+
+    async def execute(index, task, output: TaskOutput) -> None:
+        # 每个任务在独立的 asyncio 任务里运行，设置的缓冲只对本任务及其派生的协程生效
+        TASK_OUTPUT.set(output)
+        savepath = TASK_PLANS.get(task).savepath
+        # 先拿目录锁再占并发名额，等锁的任务不占名额
+        async with savepath_locks.hold(savepath), semaphore:
+            if deadline is not None and time.monotonic() >= deadline:
+                # 整次运行的预算已用完，剩余任务留到下次
+                logger.warning(f"⏰ 运行超时，跳过任务: {task['taskname']}")
+                TIMED_OUT_TASKS.append(f"{account.nickname}/{task['taskname']}（未执行）")
+                add_notify(f"⏰《{task['taskname']}》运行超时，本次未执行\n")
+                return
+            logger.info(f"#{index+1}------------------ {account.nickname}")
             logger.info(f"任务名称: {task['taskname']}")
             logger.info(f"分享链接: {task['shareurl']}")
             logger.info(f"目标目录: {task['savepath']}")
@@ -949,8 +2822,21 @@ async def do_save(session: aiohttp.ClientSession, account: Quark, tasklist: List
                 logger.info(f"忽略后缀: {task['ignore_extension']}")
             if task.get("update_subdir"):
                 logger.info(f"更子目录: {task['update_subdir']}")
-            is_new = await account.do_save_task(session, task)
-            is_rename = await account.do_rename_task(session, task)
+            task_deadline = deadline_after(TASK_TIMEOUT, deadline)
+            try:
+                is_new, is_rename = await asyncio.wait_for(run_task(task, task_deadline), time_left(task_deadline))
+            except asyncio.TimeoutError:
+                logger.error(f"⏰ 任务超时，已取消: {task['taskname']}")
+                TIMED_OUT_TASKS.append(f"{account.nickname}/{task['taskname']}")
+                add_notify(f"⏰《{task['taskname']}》执行超时，已取消本次转存\n")
+                return
+            except Exception as e:
+                # 并发执行时一个任务出错不影响其余任务
+                logger.error(f"❌ 任务执行异常: {task['taskname']}: {e}")
+                add_notify(f"❌《{task['taskname']}》执行异常：{e}\n")
+                return
+            finally:
+                SHARE_SNAPSHOTS.release(account.index, task)
             if emby.is_active and (is_new or is_rename) and task.get("emby_id") != "0":
                 if task.get("emby_id"):
                     await emby.refresh(session, task["emby_id"])
@@ -959,8 +2845,57 @@ async def do_save(session: aiohttp.ClientSession, account: Quark, tasklist: List
                     if match_emby_id:
                         task["emby_id"] = match_emby_id
                         await emby.refresh(session, match_emby_id)
+        return
+
+    runs: List[Tuple[TaskOutput, asyncio.Future]] = []
+    for index, task in enumerate(tasklist):
+        if check_date(task):
+            output = TaskOutput()
+            runs.append((output, asyncio.ensure_future(execute(index, task, output))))
+        else:
+            SHARE_SNAPSHOTS.release(account.index, task)
+    try:
+        # 任务并发执行，日志和通知按任务列表顺序输出；任务异常退出时已缓存的输出也不丢
+        for output, future in runs:
+            try:
+                await future
+            finally:
+                output.flush()
+    finally:
+        for output, future in runs:
+            future.cancel()
+            output.flush()
+    for text in CIRCUIT_BREAKERS.report(account.account_keys()):
+        add_notify(f"⛔ 接口熔断：{text}\n")
     logger.info("转存任务完成")
 
+async def run_account(session: aiohttp.ClientSession, account: Quark, name: str, tasklist: List[Dict[str, Any]], limit: asyncio.Semaphore, deadline: Optional[float] = None) -> None:
+    """单个账号的完整流程：验证 → 签到 → 转存 → 推送，各账号互不等待"""
+    # 账号只收集通知，日志实时输出；任务日志由 do_save 按任务顺序逐个输出
+    output = TaskOutput(buffer_logs=False)
+    TASK_OUTPUT.set(output)
+    async with limit:
+        logger.info(f"===============处理账号: {name} ===============")
+        try:
+            await verify_account(session, account)
+            await do_sign(session, account)
+            if account.is_active and tasklist:
+                await do_save(session, account, tasklist, deadline)
+        except Exception as e:
+            # 一个账号出错不影响其余账号，已产生的通知照常推送
+            logger.error(f"❌ 账号处理异常: {name}: {e}")
+            add_notify(f"❌ 账号 {name} 处理异常：{e}\n")
+        finally:
+            # 账号失效或中途出错时没执行的任务也不再需要分享快照
+            for task in tasklist:
+                SHARE_SNAPSHOTS.release(account.index, task)
+        if output.notifies:
+            # 推送是同步网络请求，放到线程里执行，避免阻塞其它账号
+            notify_body = "\n".join(output.notifies)
+            await asyncio.get_running_loop().run_in_executor(
+                None, send_ql_notify, "【夸克自动追更】", notify_body, account.index - 1
+            )
+
 class Emby:
     def __init__(self, emby_url: str, emby_apikey: str):
         self.is_active = False
@@ -972,7 +2907,7 @@ class Emby:
     async def get_info(self, session):
         url = f"{self.emby_url}/emby/System/Info"
         headers = {"X-Emby-Token": self.emby_apikey}
-        response = await fetch(session, "GET", url, headers=headers, params={})
+        response = await fetch(session, "GET", url, endpoint="emby", headers=headers, params={})
         if response and "application/json" in response.get("Content-Type", ""):
             logger.info(
                 f"Emby媒体库: {response.get('ServerName','')} v{response.get('Version','')}"
@@ -993,7 +2928,7 @@ class Emby:
                 "ReplaceAllMetadata": "false",
                 "ReplaceAllImages": "false",
             }
-            response = await fetch(session, "POST", url, headers=headers, params=querystring)
+            response = await fetch(session, "POST", url, endpoint="emby", headers=headers, params=querystring)
             if response and response.get("text") == "":
                 logger.info(f"🎞 刷新Emby媒体库：成功✅")
                 return True
@@ -1016,7 +2951,7 @@ class Emby:
                 "Limit": 10,
                 "IncludeSearchTypes": "false",
             }
-            response = await fetch(session, "GET", url, headers=headers, params=querystring)
+            response = await fetch(session, "GET", url, endpoint="emby", headers=headers, params=querystring)
             if response and "application/json" in response.get("Content-Type", ""):
                 if response.get("Items"):
                     for item in response["Items"]:
@@ -1102,45 +3037,80 @@ async def main():
         logger.error("❌ cookie 未配置")
         return
 
-    async with aiohttp.ClientSession() as session:
+    # 旧版本把水位写在任务配置里，现已移到单独的状态文件，写回配置时去掉
+    for tasklist in cookie_tasklists:
+        for task in tasklist:
+            task.pop("watermark", None)
+
+    RETRY_POLICY.reset()
+    REQUEST_METRICS.reset()
+    TIMED_OUT_TASKS.clear()
+    CIRCUIT_BREAKERS.reset()
+    TASK_POLLER.reset()
+    TASK_PLANS.reset_stats()
+    run_deadline = deadline_after(RUN_TIMEOUT)
+    LISTING_CACHE.load()
+    PATH_INDEX.load()
+    WATERMARKS.load()
+    STOKEN_STORE.load()
+    async with create_session() as session:
         accounts = [Quark(cookie, index) for index, cookie in enumerate(cookies)]
-        logger.info("===============验证账号===============")
-        verify_tasks = [verify_account(session, account) for account in accounts]
-        await asyncio.gather(*verify_tasks)
-        logger.info("===============签到任务===============")
-        sign_tasks = [do_sign(session, account) for account in accounts]
-        await asyncio.gather(*sign_tasks)
-        logger.info("===============转存任务===============")
-        
-        # 为每个有效的账号执行对应的转存任务
-        for i, account in enumerate(accounts):
-            if account.is_active and cookie_form_file and i < len(cookie_tasklists):
-                tasklist = cookie_tasklists[i]
-                if tasklist:  # 只有该cookie有任务时才执行转存
-                    # 如果指定了cookie_index，只处理该cookie
-                    if cookie_index is not None and i != cookie_index:
-                        continue
-                    
-                    logger.info(f"===============处理账号: {cookie_names[i]} ===============")
-                    if task_index is not None and 0 <= task_index < len(tasklist):
-                        await do_save(session, account, [tasklist[task_index]])
-                    else:
-                        await do_save(session, account, tasklist)
-                    
-                    # 处理完当前账号后，发送该账号的通知
-                    if NOTIFYS:
-                        notify_body = "\n".join(NOTIFYS)
-                        send_ql_notify("【夸克自动追更】", notify_body, cookie_index=i)
-                        # 清空NOTIFYS，为下一个账号做准备
-                        NOTIFYS.clear()
-        
-        logger.info("===============推送通知===============")
-        # 这里不再需要发送通知，因为每个账号处理完后已经发送了
+
+        def account_tasklist(i: int) -> List[Dict[str, Any]]:
+            # 只有配置文件里该账号有任务时才转存；指定了 cookie_index 时只转存该账号
+            if not cookie_form_file or i >= len(cookie_tasklists):
+                return []
+            if cookie_index is not None and i != cookie_index:
+                return []
+            tasklist = cookie_tasklists[i]
+            if task_index is not None and 0 <= task_index < len(tasklist):
+                return [tasklist[task_index]]
+            return tasklist
+
+        # 各账号的验证、签到、转存、推送流水线并发执行，任务日志按任务整块输出
+        limit = asyncio.Semaphore(max(1, ACCOUNT_CONCURRENCY))
+        tasklists = [account_tasklist(i) for i in range(len(accounts))]
+        SHARE_SNAPSHOTS.begin({account.index: tasklists[i] for i, account in enumerate(accounts)})
+        futures = [
+            asyncio.ensure_future(run_account(
+                session, account, cookie_names[i], tasklists[i], limit, run_deadline,
+            ))
+            for i, account in enumerate(accounts)
+        ]
+        try:
+            await asyncio.gather(*futures)
+        finally:
+            for future in futures:
+                future.cancel()
+            SHARE_SNAPSHOTS.end()
+
         if cookie_form_file:
             with open(config_path, "w", encoding="utf-8") as file:
                 json.dump(CONFIG_DATA, file, ensure_ascii=False, indent=2)
     end_time = datetime.now()
     duration = end_time - start_time
+    logger.info(f"🔁 重试统计: {RETRY_POLICY.summary()}")
+    logger.info(f"📊 接口统计: {REQUEST_METRICS.summary()}")
+    logger.info(f"⏳ 转存任务: {TASK_POLLER.summary()}")
+    logger.info(f"🧩 任务计划: {TASK_PLANS.summary()}")
+    logger.info(f"💾 列表缓存: {LISTING_CACHE.summary()}")
+    logger.info(f"🗂️ 分享快照: {SHARE_SNAPSHOTS.summary()}")
+    logger.info(f"🎫 stoken 缓存: {STOKEN_STORE.summary()}")
+    await STOKEN_STORE.flush()
+    LISTING_CACHE.save()
+    logger.info(f"📂 路径索引: {PATH_INDEX.summary()}")
+    PATH_INDEX.save()
+    logger.info(f"🌊 增量水位: {WATERMARKS.summary()}")
+    WATERMARKS.save()
+    for account in accounts:
+        for text in CIRCUIT_BREAKERS.report(account.account_keys()):
+            logger.warning(f"⛔ 熔断统计 [{account.nickname or f'账号{account.index}'}]: {text}")
+    if TIMED_OUT_TASKS:
+        logger.warning(f"⏰ 超时任务 {len(TIMED_OUT_TASKS)} 个: {'，'.join(TIMED_OUT_TASKS)}")
+    try:
+        REQUEST_METRICS.write(METRICS_DIR)
+    except OSError as e:
+        logger.warning(f"接口统计写入失败: {e}")
     logger.info("===============程序结束===============")
     logger.info(f"😃 运行时长: {round(duration.total_seconds(), 2)}s")
 
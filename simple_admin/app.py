@@ -517,14 +517,13 @@ def get_cookie_tasklist(cookie_index):
         import sys
         import os
         import asyncio
-        import aiohttp
         
         # 添加父目录到路径
         parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         sys.path.insert(0, parent_dir)
         
         try:
-            from quark_auto_save import Quark
+            from quark_auto_save import Quark, create_session
         except ImportError:
             logger.error("无法导入Quark类")
             # 如果无法导入Quark类，返回假设所有任务都有效
@@ -543,7 +542,7 @@ def get_cookie_tasklist(cookie_index):
                 # 创建Quark对象
                 quark = Quark(cookie_value, cookie_index)
                 
-                async def check_task_validity(task):
+                async def check_task_validity(session, task):
                     """检查单个任务的有效性"""
                     try:
                         shareurl = task.get("shareurl", "")
@@ -558,23 +557,23 @@ def get_cookie_tasklist(cookie_index):
                         pwd_id, _ = result
                         
                         # 检查stoken - 对于公开分享链接，不需要账号初始化
-                        async with aiohttp.ClientSession() as session:
-                            # 直接检查链接有效性，不进行账号初始化
-                            # 因为公开分享的链接不需要有效Cookie
-                            is_valid, message = await quark.get_stoken(session, pwd_id)
-                            return is_valid
+                        # 因为公开分享的链接不需要有效Cookie
+                        is_valid, message = await quark.get_stoken(session, pwd_id)
+                        return is_valid
                     except Exception as e:
                         logger.error(f"检查任务有效性失败: {e}")
                         return False
                 
                 async def check_all_tasks():
                     """检查所有任务的有效性"""
-                    tasks_to_check = []
-                    for task in tasklist:
-                        tasks_to_check.append(check_task_validity(task))
-                    
-                    # 批量检查所有任务
-                    results = await asyncio.gather(*tasks_to_check, return_exceptions=True)
+                    # 所有任务共用一个会话，复用连接池中的长连接
+                    async with create_session() as session:
+                        tasks_to_check = []
+                        for task in tasklist:
+                            tasks_to_check.append(check_task_validity(session, task))
+                        
+                        # 批量检查所有任务
+                        results = await asyncio.gather(*tasks_to_check, return_exceptions=True)
                     
                     valid = 0
                     invalid = 0
@@ -862,7 +861,7 @@ def check_link_validity():
         sys.path.insert(0, parent_dir)
         
         try:
-            from quark_auto_save import Quark
+            from quark_auto_save import Quark, create_session
         except ImportError:
             return jsonify({"success": False, "message": "无法导入Quark类"}), 500
         
@@ -871,10 +870,9 @@ def check_link_validity():
         
         # 检查链接有效性
         import asyncio
-        import aiohttp
         
         async def check_validity():
-            async with aiohttp.ClientSession() as session:
+            async with create_session() as session:
                 # 直接检查链接有效性，不进行账号初始化
                 # 因为公开分享的链接是公开的，和cookie无关
                 
@@ -927,7 +925,7 @@ def validate_cookie():
         sys.path.insert(0, parent_dir)
         
         try:
-            from quark_auto_save import Quark
+            from quark_auto_save import Quark, create_session
         except ImportError:
             return jsonify({"success": False, "message": "无法导入Quark类"}), 500
         
@@ -936,10 +934,9 @@ def validate_cookie():
         
         # 检查Cookie有效性
         import asyncio
-        import aiohttp
         
         async def check_cookie_validity():
-            async with aiohttp.ClientSession() as session:
+            async with create_session() as session:
                 try:
                     # 尝试初始化账号来验证Cookie
                     account_info = await quark.init(session)